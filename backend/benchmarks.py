@@ -0,0 +1,467 @@
+"""Backend benchmarks.
+
+Run from the backend directory against a MongoDB configured through .env, e.g.
+
+    python benchmarks.py cold-start
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import requests
+
+ROOT_DIR = Path(__file__).parent
+
+
+def cold_start(args):
+    """Start uvicorn and measure process start -> ready -> first fast request."""
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ, FAST_REQUEST_MS=str(args.fast_ms))
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(args.port)],
+        cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        ready_at = None
+        while time.perf_counter() - started < args.timeout:
+            try:
+                if requests.get(f"{base_url}/api/health/ready", timeout=1).status_code == 200:
+                    ready_at = time.perf_counter()
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(0.05)
+        if ready_at is None:
+            print("backend did not become ready")
+            return 1
+
+        first_fast_at = None
+        latencies = []
+        for _ in range(args.requests):
+            t0 = time.perf_counter()
+            requests.get(f"{base_url}/api/settings/public", timeout=5)
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            latencies.append(elapsed_ms)
+            if first_fast_at is None and elapsed_ms <= args.fast_ms:
+                first_fast_at = time.perf_counter()
+
+        startup = requests.get(f"{base_url}/api/health/ready", timeout=5).json()["startup"]
+        print(f"process start -> ready:        {(ready_at - started) * 1000:8.1f} ms")
+        if first_fast_at is not None:
+            print(f"process start -> fast request: {(first_fast_at - started) * 1000:8.1f} ms")
+        print(f"first request latency:         {latencies[0]:8.1f} ms")
+        print(f"median request latency:        {sorted(latencies)[len(latencies) // 2]:8.1f} ms")
+        print(f"server warm-up:                {startup['startup_ms']} ms, "
+              f"{startup['warmup_connections']} connections")
+        return 0
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+SERVER_TIMING_RE = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+
+def _db_timing(response):
+    match = SERVER_TIMING_RE.search(response.headers.get("Server-Timing", ""))
+    return (int(match.group(2)), float(match.group(1))) if match else (None, None)
+
+
+def route_queries(args):
+    """Report MongoDB round trips per route from the Server-Timing header.
+
+    Needs a backend started with DB_PROFILER_SERVER_TIMING=true. Exits non-zero
+    when a route issues more than --max-queries commands, which catches N+1
+    regressions in CI.
+    """
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    failed = False
+    for path in args.paths:
+        response = requests.get(f"{args.base_url}/api{path}", headers=headers, timeout=10)
+        queries, db_ms = _db_timing(response)
+        if queries is None:
+            print(f"{path}: no Server-Timing header (status {response.status_code})")
+            failed = True
+            continue
+        over = queries > args.max_queries
+        failed = failed or over
+        print(f"{path:40} {queries:4d} queries {db_ms:8.2f} ms{'  OVER BUDGET' if over else ''}")
+    return 1 if failed else 0
+
+
+def trader_roundtrips(args):
+    """Exercise every trader route once and print its MongoDB round trips.
+
+    Needs a backend started with DB_PROFILER_SERVER_TIMING=true and a trader token.
+    Creates, updates and deletes one throwaway card.
+    """
+    api = f"{args.base_url}/api"
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {args.token}"
+
+    results = [("GET /trader/profile", session.get(f"{api}/trader/profile"))]
+    created = session.post(f"{api}/trader/cards", json={
+        "card_number": "4149000000000000", "bank_name": "Benchmark",
+        "holder_name": "BENCH", "limit": 1000, "currency": "UAH"
+    })
+    card_id = created.json().get("id")
+    results += [
+        ("POST /trader/cards", created),
+        ("GET /trader/cards", session.get(f"{api}/trader/cards")),
+        ("PUT /trader/cards/{id}", session.put(f"{api}/trader/cards/{card_id}", json={"limit": 2000})),
+        ("GET /trader/transactions", session.get(f"{api}/trader/transactions")),
+        ("POST /trader/confirm-payment/{id}", session.post(f"{api}/trader/confirm-payment/missing")),
+        ("DELETE /trader/cards/{id}", session.delete(f"{api}/trader/cards/{card_id}")),
+    ]
+
+    for name, response in results:
+        queries, db_ms = _db_timing(response)
+        if queries is None:
+            print(f"{name:36} status {response.status_code}, no Server-Timing header")
+        else:
+            print(f"{name:36} status {response.status_code} {queries:3d} round trips {db_ms:7.2f} ms")
+    return 0
+
+
+def _import_server(db_name=None):
+    # server.py only builds a lazy Motor client at import; nothing here touches MongoDB
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "benchmark")
+    import server
+    if db_name:
+        server.db = server.client[db_name]
+    return server
+
+
+async def _simulate_scarcity(args, use_queue):
+    CardMatchingQueue = _import_server().CardMatchingQueue
+
+    rng = random.Random(args.seed)
+    headroom = [args.card_limit] * args.cards
+    held = []
+    counters = {"attempts": 0, "served": 0, "failed": 0}
+    queue = CardMatchingQueue(policy=args.policy)
+    loop = asyncio.get_running_loop()
+
+    def try_allocate(amount):
+        counters["attempts"] += 1
+        for i, free in enumerate(headroom):
+            if free >= amount:
+                headroom[i] -= amount
+                held.append((i, amount))
+                return True
+        return False
+
+    async def release_capacity():
+        # Transactions expiring or completing hand their amount back to the card
+        while True:
+            await asyncio.sleep(args.release_interval)
+            if held:
+                i, amount = held.pop(rng.randrange(len(held)))
+                headroom[i] += amount
+                if use_queue:
+                    queue.notify("UAH", headroom)
+
+    async def client(amount):
+        deadline = loop.time() + args.timeout
+        requeue = False
+        while not try_allocate(amount):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                counters["failed"] += 1
+                return
+            if use_queue:
+                if not await queue.wait("UAH", amount, remaining, front=requeue):
+                    counters["failed"] += 1
+                    return
+                requeue = True
+            else:
+                await asyncio.sleep(min(args.retry_interval, remaining))
+        counters["served"] += 1
+
+    releaser = asyncio.create_task(release_capacity())
+    await asyncio.gather(*[
+        client(rng.choice([100, 250, 500, 1000]))
+        for _ in range(args.clients)
+    ])
+    releaser.cancel()
+    counters["wasted"] = counters["attempts"] - counters["served"]
+    return counters
+
+
+def card_queue_sim(args):
+    """Compare client retry loops with the card matching queue under scarcity."""
+    for label, use_queue in (("client retries", False), (f"queue ({args.policy})", True)):
+        result = asyncio.run(_simulate_scarcity(args, use_queue))
+        print(f"{label:18} served {result['served']:5d}  failed {result['failed']:5d}  "
+              f"allocation attempts {result['attempts']:7d}  wasted {result['wasted']:7d}")
+    return 0
+
+
+async def _time_queries(server, users, traders, repeats):
+    async def measure(coro_factory):
+        samples = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            await coro_factory()
+            samples.append((time.perf_counter() - t0) * 1000)
+        return sorted(samples)[len(samples) // 2]
+
+    user_id, trader_id = users[0], traders[0]
+    return {
+        "user list": await measure(lambda: server.find_transactions({"user_id": user_id})),
+        "trader list": await measure(lambda: server.find_transactions({"trader_id": trader_id})),
+        "admin list": await measure(lambda: server.find_transactions({})),
+        "trader completed count": await measure(
+            lambda: server.db.transactions.count_documents({"trader_id": trader_id, "status": "completed"})),
+        "pending scan": await measure(
+            lambda: server.db.transactions.count_documents({"status": "user_confirmed"})),
+    }
+
+
+async def _collection_size(server, name):
+    stats = await server.db.command("collStats", name)
+    return stats["count"], stats["size"] / 2**20, stats["totalIndexSize"] / 2**20
+
+
+async def _archive_latency(args):
+    from datetime import datetime, timedelta, timezone
+
+    server = _import_server(args.db)
+    server.ARCHIVE_BATCH_SIZE = args.batch_size
+    await server.client.drop_database(args.db)
+    await server.ensure_indexes()
+
+    users = [f"user-{i}" for i in range(args.users)]
+    traders = [f"trader-{i}" for i in range(args.traders)]
+    now = datetime.now(timezone.utc)
+    old_age_days = server.ARCHIVE_AFTER_DAYS + 1
+    print(f"seeding {args.rows} settled and {args.hot_rows} recent transactions into {args.db}")
+    for offset in range(0, args.rows + args.hot_rows, 10000):
+        batch = []
+        for n in range(offset, min(offset + 10000, args.rows + args.hot_rows)):
+            settled = n < args.rows
+            created = now - timedelta(days=old_age_days + n % 365 if settled else 0, seconds=n)
+            batch.append({
+                "id": f"txn-{n}",
+                "user_id": users[n % len(users)],
+                "trader_id": traders[n % len(traders)],
+                "card_id": "card-0",
+                "amount": 1000.0,
+                "currency": "UAH",
+                "status": ("completed" if n % 4 else "cancelled") if settled else "user_confirmed",
+                "created_at": created,
+                "expires_at": created + timedelta(minutes=30)
+            })
+        await server.db.transactions.insert_many(batch, ordered=False)
+
+    before = await _time_queries(server, users, traders, args.repeats)
+    hot_before = await _collection_size(server, "transactions")
+
+    t0 = time.perf_counter()
+    moved = await server.archive_settled_transactions()
+    archive_s = time.perf_counter() - t0
+
+    after = await _time_queries(server, users, traders, args.repeats)
+    hot_after = await _collection_size(server, "transactions")
+
+    print(f"archived {moved} rows in {archive_s:.1f}s")
+    print(f"hot collection: {hot_before[0]} docs {hot_before[1]:.1f} MiB data {hot_before[2]:.1f} MiB indexes"
+          f" -> {hot_after[0]} docs {hot_after[1]:.1f} MiB data {hot_after[2]:.1f} MiB indexes")
+    print(f"{'query':26} {'single tier':>12} {'tiered':>12}  (median ms)")
+    for name in before:
+        print(f"{name:26} {before[name]:12.2f} {after[name]:12.2f}")
+    await server.client.drop_database(args.db)
+    return 0
+
+
+def archive_latency(args):
+    """Seed historical transactions, archive them and compare hot-path query latency."""
+    return asyncio.run(_archive_latency(args))
+
+
+def _plan_stages(plan):
+    yield plan["stage"]
+    for child in plan.get("inputStages", []) + ([plan["inputStage"]] if "inputStage" in plan else []):
+        yield from _plan_stages(child)
+
+
+async def _explain_filters(args):
+    from datetime import datetime, timezone
+
+    server = _import_server(args.db)
+    await server.client.drop_database(args.db)
+    await server.ensure_indexes()
+
+    transaction_filters = {
+        "status_filter": "completed",
+        "trader_id": "trader-1",
+        "currency": "UAH",
+        "amount_min": 100.0,
+        "amount_max": 5000.0,
+        "date_from": datetime(2025, 1, 1, tzinfo=timezone.utc),
+        "date_to": datetime(2026, 1, 1, tzinfo=timezone.utc),
+    }
+    user_filters = {"q": "Ad", "role": "trader", "is_blocked": False}
+    cases = []
+    for collection, builder, filters in (
+        ("transactions", server.build_transaction_filter, transaction_filters),
+        ("transactions_archive", server.build_transaction_filter, transaction_filters),
+        ("users", server.build_user_filter, user_filters),
+    ):
+        for size in range(len(filters) + 1):
+            for names in itertools.combinations(filters, size):
+                cases.append((collection, ",".join(names) or "(none)", builder(**{n: filters[n] for n in names})))
+    for q in ("nick", "+380 67", "Nick 67"):
+        cases.append(("traders", f"q={q!r}", server.build_trader_filter(q)))
+
+    scans = 0
+    for collection, label, query in cases:
+        plan = await server.db[collection].find(query).sort("created_at", -1).limit(50).explain()
+        stages = set(_plan_stages(plan["queryPlanner"]["winningPlan"]))
+        if "COLLSCAN" in stages:
+            scans += 1
+            print(f"COLLSCAN {collection:22} {label}")
+        elif args.verbose:
+            print(f"ok       {collection:22} {label}: {', '.join(sorted(stages))}")
+    print(f"{len(cases)} filter combinations checked, {scans} collection scans")
+    await server.client.drop_database(args.db)
+    return 1 if scans else 0
+
+
+def explain_filters(args):
+    """Explain every supported admin filter combination and fail on collection scans."""
+    return asyncio.run(_explain_filters(args))
+
+
+async def _payload_size(args):
+    import httpx
+
+    server = _import_server(args.db)
+    server.reporting_db = server.db
+    await server.client.drop_database(args.db)
+    await server.ensure_indexes()
+
+    admin = server.User(email="bench-admin@example.com", password_hash=server.hash_password("bench"), role="admin")
+    trader_user = server.User(email="bench-trader@example.com", password_hash=server.hash_password("bench"), role="trader")
+    trader = server.Trader(user_id=trader_user.id, name="Bench", nickname="bench", usdt_address="TBench", phone="+380000000000")
+    card = server.Card(trader_id=trader.id, card_number="4149000000000000", bank_name="Bench", holder_name="BENCH", limit=1e9)
+    await server.db.users.insert_many([admin.model_dump(), trader_user.model_dump()] + [
+        server.User(email=f"bench{i}@example.com", password_hash="x").model_dump() for i in range(args.rows)
+    ])
+    await server.db.traders.insert_one(trader.model_dump())
+    await server.db.cards.insert_one(card.model_dump())
+    await server.db.transactions.insert_many([
+        server.Transaction(user_id=admin.id, trader_id=trader.id, card_id=card.id, amount=100.0 + i).model_dump()
+        for i in range(args.rows)
+    ])
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        tokens = {}
+        for email in (admin.email, trader_user.email):
+            response = await http.post("/api/auth/login", json={"email": email, "password": "bench"})
+            tokens[email] = {"Authorization": f"Bearer {response.json()['token']}"}
+        routes = [
+            ("/api/admin/transactions", tokens[admin.email], "id,amount,status,created_at"),
+            ("/api/admin/users", tokens[admin.email], "email,role,is_blocked"),
+            ("/api/trader/transactions", tokens[trader_user.email], "id,amount,status,card.bank_name"),
+            ("/api/user/transactions", tokens[admin.email], "id,amount,status"),
+        ]
+        encodings = ["identity", "gzip"] + (["br"] if server.brotli else [])
+        print(f"{args.rows} rows per list, median of {args.repeats} requests")
+        print(f"{'route':28} {'fields':7} {'encoding':9} {'bytes':>10} {'cpu ms':>8}")
+        for path, headers, fields in routes:
+            for sparse in (False, True):
+                url = f"{path}?limit=1000" + (f"&fields={fields}" if sparse else "")
+                for encoding in encodings:
+                    sizes, cpu = [], []
+                    for _ in range(args.repeats):
+                        t0 = time.process_time()
+                        response = await http.get(url, headers={**headers, "Accept-Encoding": encoding})
+                        cpu.append((time.process_time() - t0) * 1000)
+                        sizes.append(response.num_bytes_downloaded)
+                    print(f"{path:28} {'sparse' if sparse else 'full':7} {encoding:9} "
+                          f"{sizes[0]:10d} {sorted(cpu)[len(cpu) // 2]:8.2f}")
+    await server.client.drop_database(args.db)
+    return 0
+
+
+def payload_size(args):
+    """Bytes on the wire and process CPU per response for the large list routes.
+
+    Runs the app in-process against a scratch database, so the CPU figure
+    covers the handler, serialisation, compression and the driver.
+    """
+    return asyncio.run(_payload_size(args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("cold-start", help="time from process start to first fast request")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--fast-ms", type=float, default=50)
+    p.add_argument("--requests", type=int, default=20)
+    p.add_argument("--timeout", type=float, default=30)
+    p.set_defaults(func=cold_start)
+
+    p = sub.add_parser("route-queries", help="MongoDB round trips per route")
+    p.add_argument("paths", nargs="+", help="paths below /api, e.g. /trader/transactions")
+    p.add_argument("--base-url", default="http://127.0.0.1:8001")
+    p.add_argument("--token")
+    p.add_argument("--max-queries", type=int, default=10)
+    p.set_defaults(func=route_queries)
+
+    p = sub.add_parser("trader-roundtrips", help="MongoDB round trips of each trader route")
+    p.add_argument("--base-url", default="http://127.0.0.1:8001")
+    p.add_argument("--token", required=True, help="token of a user with a trader profile")
+    p.set_defaults(func=trader_roundtrips)
+
+    p = sub.add_parser("card-queue-sim", help="simulate card allocation under scarcity")
+    p.add_argument("--clients", type=int, default=500)
+    p.add_argument("--cards", type=int, default=5)
+    p.add_argument("--card-limit", type=float, default=2000)
+    p.add_argument("--timeout", type=float, default=3)
+    p.add_argument("--retry-interval", type=float, default=0.05)
+    p.add_argument("--release-interval", type=float, default=0.01)
+    p.add_argument("--policy", choices=["fifo", "amount"], default="fifo")
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=card_queue_sim)
+
+    p = sub.add_parser("archive-latency", help="query latency with and without transaction archiving")
+    p.add_argument("--rows", type=int, default=1_000_000, help="settled historical rows, e.g. 10000000")
+    p.add_argument("--hot-rows", type=int, default=20_000)
+    p.add_argument("--users", type=int, default=5_000)
+    p.add_argument("--traders", type=int, default=200)
+    p.add_argument("--batch-size", type=int, default=10_000)
+    p.add_argument("--repeats", type=int, default=20)
+    p.add_argument("--db", default="skypall_archive_bench", help="scratch database, dropped before and after")
+    p.set_defaults(func=archive_latency)
+
+    p = sub.add_parser("explain-filters", help="check admin search filters never scan a collection")
+    p.add_argument("--db", default="skypall_explain_check", help="scratch database, dropped before and after")
+    p.add_argument("--verbose", action="store_true")
+    p.set_defaults(func=explain_filters)
+
+    p = sub.add_parser("payload-size", help="response bytes and CPU with compression and sparse fields")
+    p.add_argument("--rows", type=int, default=1000)
+    p.add_argument("--repeats", type=int, default=20)
+    p.add_argument("--db", default="skypall_payload_bench", help="scratch database, dropped before and after")
+    p.set_defaults(func=payload_size)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Convert ISO-string timestamps to native BSON dates, online and resumably.
+
+Documents are visited in _id order in small batches. Each field is only
+rewritten if it still holds the string that was read, so concurrent writes by
+the running backend are never overwritten. Progress is checkpointed in the
+`migrations` collection after every batch, and an interrupted run resumes from
+the last checkpoint.
+
+    python migrate_datetimes.py               # migrate every collection
+    python migrate_datetimes.py --verify      # count string timestamps left
+    python migrate_datetimes.py --restart     # ignore saved checkpoints
+
+Once --verify reports zero everywhere, set LEGACY_STRING_DATES=false for the backend.
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+DATE_FIELDS = {
+    "users": ["created_at"],
+    "traders": ["created_at"],
+    "cards": ["created_at"],
+    "transactions": ["created_at", "expires_at", "user_confirmed_at", "completed_at", "cancelled_at"],
+    "transactions_archive": ["created_at", "expires_at", "user_confirmed_at", "completed_at", "cancelled_at"],
+}
+MIGRATION_ID = "bson_datetimes"
+
+
+def parse_timestamp(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def string_filter(fields):
+    return {"$or": [{field: {"$type": "string"}} for field in fields]}
+
+
+def migrate_collection(db, name, fields, batch_size, pause, restart):
+    checkpoint_id = f"{MIGRATION_ID}:{name}"
+    if restart:
+        db.migrations.delete_one({"_id": checkpoint_id})
+    checkpoint = db.migrations.find_one({"_id": checkpoint_id}) or {"last_id": None, "converted": 0}
+    last_id, converted = checkpoint["last_id"], checkpoint["converted"]
+
+    while True:
+        query = string_filter(fields)
+        if last_id is not None:
+            query = {"_id": {"$gt": last_id}, **query}
+        docs = list(db[name].find(query, {field: 1 for field in fields}).sort("_id", 1).limit(batch_size))
+        if not docs:
+            break
+
+        updates = []
+        for doc in docs:
+            for field in fields:
+                value = doc.get(field)
+                if not isinstance(value, str):
+                    continue
+                try:
+                    parsed = parse_timestamp(value)
+                except ValueError:
+                    print(f"  {name} {doc['_id']}: unparseable {field}={value!r}, left as is")
+                    continue
+                updates.append(UpdateOne({"_id": doc["_id"], field: value}, {"$set": {field: parsed}}))
+        if updates:
+            converted += db[name].bulk_write(updates, ordered=False).modified_count
+
+        last_id = docs[-1]["_id"]
+        db.migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"last_id": last_id, "converted": converted, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        if pause:
+            time.sleep(pause)
+
+    db.migrations.update_one(
+        {"_id": checkpoint_id},
+        {"$set": {"done": True, "updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    print(f"{name}: {converted} fields converted")
+
+
+def verify(db):
+    remaining = 0
+    for name, fields in DATE_FIELDS.items():
+        for field in fields:
+            count = db[name].count_documents({field: {"$type": "string"}})
+            remaining += count
+            print(f"{name}.{field}: {count} string values")
+    return remaining
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to sleep between batches")
+    parser.add_argument("--collection", choices=sorted(DATE_FIELDS), action="append")
+    parser.add_argument("--restart", action="store_true", help="discard saved checkpoints")
+    parser.add_argument("--verify", action="store_true")
+    args = parser.parse_args()
+
+    client = MongoClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    if args.verify:
+        raise SystemExit(1 if verify(db) else 0)
+
+    for name in args.collection or DATE_FIELDS:
+        migrate_collection(db, name, DATE_FIELDS[name], args.batch_size, args.pause, args.restart)
+
+
+if __name__ == "__main__":
+    main()
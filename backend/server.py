@@ -1,36 +1,247 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, status
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers, MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError
+from pymongo.read_preferences import SecondaryPreferred
+from bson import Timestamp
 import os
+import json
 import logging
+import asyncio
+import threading
+import time
+import contextvars
+import heapq
+import re
+import urllib.request
+import zlib
+from contextlib import asynccontextmanager
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional
+from collections import OrderedDict, deque
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 
+try:
+    import brotli  # optional; without it responses are only gzip-compressed
+except ImportError:
+    brotli = None
+
+PROCESS_STARTED_AT = time.monotonic()
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ===== MONGODB MONITORING =====
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Tracks connection pool usage so health checks can report saturation.
+
+    PyMongo calls these hooks from Motor's executor threads, hence the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkout_failures = 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "waiting": self.waiting,
+                "checkout_failures": self.checkout_failures,
+            }
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open = max(0, self.open - 1)
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.waiting += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting = max(0, self.waiting - 1)
+            self.checked_out += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting = max(0, self.waiting - 1)
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+DB_PROFILER_ENABLED = os.environ.get('DB_PROFILER', 'true').lower() == 'true'
+DB_PROFILER_SERVER_TIMING = os.environ.get('DB_PROFILER_SERVER_TIMING', 'false').lower() == 'true'
+SLOW_REQUEST_QUERY_COUNT = int(os.environ.get('SLOW_REQUEST_QUERY_COUNT', '20'))
+SLOW_REQUEST_DB_MS = float(os.environ.get('SLOW_REQUEST_DB_MS', '200'))
+SLOW_COMMAND_MS = float(os.environ.get('SLOW_COMMAND_MS', '100'))
+PROFILER_TOP_COMMANDS = 3
+
+class RequestProfile:
+    """MongoDB commands issued while serving one request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.query_count = 0
+        self.db_ms = 0.0
+        self.commands = []  # (duration_ms, command_name, collection)
+
+    def started(self, key, command_name: str, collection):
+        with self._lock:
+            self._pending[key] = (command_name, collection)
+
+    def finished(self, key, command_name: str, duration_ms: float):
+        with self._lock:
+            _, collection = self._pending.pop(key, (command_name, None))
+            self.query_count += 1
+            self.db_ms += duration_ms
+            self.commands.append((duration_ms, command_name, collection))
+
+    def slowest(self, n: int = PROFILER_TOP_COMMANDS) -> list:
+        with self._lock:
+            return sorted(self.commands, reverse=True)[:n]
+
+current_profile: contextvars.ContextVar = contextvars.ContextVar('current_profile', default=None)
+
+class QueryProfiler(monitoring.CommandListener):
+    """Attributes every command to the request in progress.
+
+    Motor copies the caller's context into its executor threads, so the
+    contextvar set by the profiling middleware is visible here.
+    """
+
+    def started(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            collection = event.command.get(event.command_name)
+            profile.started(
+                (event.connection_id, event.request_id),
+                event.command_name,
+                collection if isinstance(collection, str) else None
+            )
+
+    def succeeded(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.finished((event.connection_id, event.request_id), event.command_name, event.duration_micros / 1000)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+# "METHOD /route/template" (or "<unmatched>") -> aggregate counters, served by /api/admin/metrics/db
+route_db_stats: dict = {}
+
+def record_route_profile(route: str, profile: RequestProfile):
+    stats = route_db_stats.setdefault(route, {"requests": 0, "queries": 0, "db_ms": 0.0, "max_queries": 0})
+    stats["requests"] += 1
+    stats["queries"] += profile.query_count
+    stats["db_ms"] += profile.db_ms
+    stats["max_queries"] = max(stats["max_queries"], profile.query_count)
+
+# ===== MONGODB CONNECTION POOL =====
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '10'))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000'))
+MONGO_WARMUP_CONNECTIONS = int(os.environ.get('MONGO_WARMUP_CONNECTIONS', str(MONGO_MIN_POOL_SIZE)))
+# A failed warm-up is retried in the background, doubling the delay up to the maximum
+WARMUP_RETRY_SECONDS = float(os.environ.get('WARMUP_RETRY_SECONDS', '1'))
+WARMUP_RETRY_MAX_SECONDS = float(os.environ.get('WARMUP_RETRY_MAX_SECONDS', '30'))
+
+pool_monitor = PoolMonitor()
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    tz_aware=True,
+    event_listeners=[pool_monitor, QueryProfiler()] if DB_PROFILER_ENABLED else [pool_monitor],
+)
 db = client[os.environ['DB_NAME']]
 
+# Reporting reads tolerate replication lag, so they go to a secondary when one is
+# fresh enough; allocation and balance checks stay on `db`, which reads the primary.
+# MongoDB rejects a max staleness below 90 seconds.
+REPORTING_MAX_STALENESS_SECONDS = max(90, int(os.environ.get('REPORTING_MAX_STALENESS_SECONDS', '90')))
+reporting_read_preference = SecondaryPreferred(max_staleness=REPORTING_MAX_STALENESS_SECONDS)
+reporting_db = client.get_database(os.environ['DB_NAME'], read_preference=reporting_read_preference)
+
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24
+JWT_DEFAULT_KID = 'default'
+# Optional JSON file {"active_kid": "k2", "keys": {"k1": "...", "k2": "..."}}, re-read when it changes.
+# Once it has loaded, only the keys it lists are valid; JWT_SECRET is then retired
+# unless the file lists it under the "default" kid.
+JWT_KEYS_FILE = os.environ.get('JWT_KEYS_FILE')
+JWT_KEYS_RELOAD_SECONDS = float(os.environ.get('JWT_KEYS_RELOAD_SECONDS', '5'))
+JWT_VERIFY_CACHE_SIZE = int(os.environ.get('JWT_VERIFY_CACHE_SIZE', '4096'))
+JWT_VERIFY_CACHE_TTL_SECONDS = float(os.environ.get('JWT_VERIFY_CACHE_TTL_SECONDS', '60'))
+TOKEN_EPOCH_REFRESH_SECONDS = float(os.environ.get('TOKEN_EPOCH_REFRESH_SECONDS', '10'))
 
 security = HTTPBearer()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not await warm_up():
+        background_tasks.append(asyncio.create_task(warm_up_until_ready()))
+    start_background_tasks()
+    yield
+    for task in background_tasks:
+        task.cancel()
+    client.close()
+
+app = FastAPI(lifespan=lifespan)
 api_router = APIRouter(prefix="/api")
 
+def phone_digits(phone: str) -> str:
+    return re.sub(r"\D", "", phone)
+
 # ===== MODELS =====
 class UserRegister(BaseModel):
     email: EmailStr
@@ -47,7 +258,11 @@ class User(BaseModel):
     password_hash: str
     role: str = "user"  # user, trader, admin
     is_blocked: bool = False
-    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    email_key: Optional[str] = None  # lowercased email for prefix search
+
+    def model_post_init(self, __context):
+        self.email_key = self.email.lower()
 
 class TraderRegister(BaseModel):
     name: str
@@ -65,7 +280,13 @@ class Trader(BaseModel):
     phone: str
     usdt_balance: float = 0.0
     is_blocked: bool = False
-    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    nickname_key: Optional[str] = None  # lowercased nickname for prefix search
+    phone_key: Optional[str] = None  # phone digits only
+
+    def model_post_init(self, __context):
+        self.nickname_key = self.nickname.lower()
+        self.phone_key = phone_digits(self.phone)
 
 class CardCreate(BaseModel):
     card_number: str
@@ -73,6 +294,7 @@ class CardCreate(BaseModel):
     holder_name: str
     limit: float
     currency: str = "UAH"
+    limit_period: str = "none"
 
 class Card(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -85,11 +307,15 @@ class Card(BaseModel):
     current_usage: float = 0.0
     status: str = "active"  # active, paused
     currency: str = "UAH"
-    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    limit_period: str = "none"  # none, daily, monthly, rolling_24h
+    window_start: Optional[datetime] = None  # start of the window current_usage counts
+    usage_buckets: dict = Field(default_factory=dict)  # hour key -> usage, rolling_24h only
 
 class CardUpdate(BaseModel):
     limit: Optional[float] = None
     status: Optional[str] = None
+    limit_period: Optional[str] = None
 
 class TransactionRequest(BaseModel):
     amount: float  # Amount in USDT user wants to receive
@@ -104,10 +330,12 @@ class Transaction(BaseModel):
     amount: float
     currency: str = "UAH"
     status: str = "pending"  # pending, user_confirmed, trader_confirmed, completed, cancelled
-    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
-    user_confirmed_at: Optional[str] = None
-    completed_at: Optional[str] = None
-    expires_at: str = Field(default_factory=lambda: (datetime.now(timezone.utc) + timedelta(minutes=30)).isoformat())
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    user_confirmed_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    cancelled_at: Optional[datetime] = None
+    usdt_amount: Optional[float] = None  # USDT debited from the trader on completion
+    expires_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc) + timedelta(minutes=30))
 
 class AdminAddBalance(BaseModel):
     amount: float
@@ -117,6 +345,77 @@ class AdminSettings(BaseModel):
     usd_to_uah_rate: float  # 1 USDT = X UAH
     deposit_wallet_address: str = "TB4K5h9QwFGSYR2LLJS9ejmt9EjHWurvi1"  # TRC-20 wallet for deposits
 
+# ===== TIMESTAMPS =====
+# Timestamps are BSON dates. Documents written before that stored ISO strings
+# until migrate_datetimes.py converts them; these helpers accept both meanwhile.
+LEGACY_STRING_DATES = os.environ.get('LEGACY_STRING_DATES', 'true').lower() == 'true'
+
+def as_datetime(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def before_date(field: str, moment: datetime) -> dict:
+    """Query fragment for `field < moment`.
+
+    BSON range operators only match values of the same type, so until the
+    migration has finished (LEGACY_STRING_DATES=false) legacy strings are
+    matched by a second, string-typed clause.
+    """
+    if LEGACY_STRING_DATES:
+        return {"$or": [{field: {"$lt": moment}}, {field: {"$lt": moment.isoformat()}}]}
+    return {field: {"$lt": moment}}
+
+def date_range(field: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> dict:
+    """Query fragment for `start <= field <= end`; legacy strings are matched as in before_date."""
+    # Legacy strings were written in UTC, so the bounds must be too to compare as strings
+    bounds = {}
+    if start is not None:
+        bounds["$gte"] = as_datetime(start).astimezone(timezone.utc)
+    if end is not None:
+        bounds["$lte"] = as_datetime(end).astimezone(timezone.utc)
+    if LEGACY_STRING_DATES:
+        legacy = {op: moment.isoformat() for op, moment in bounds.items()}
+        return {"$or": [{field: bounds}, {field: legacy}]}
+    return {field: bounds}
+
+# ===== SPARSE FIELDSETS =====
+TRANSACTION_FIELDS = set(Transaction.model_fields)
+USER_FIELDS = set(User.model_fields) - {"password_hash"}
+# The trader transaction list embeds each transaction's card as `card`
+TRADER_TRANSACTION_FIELDS = TRANSACTION_FIELDS | {"card"} | {f"card.{name}" for name in Card.model_fields}
+
+def sparse_projection(fields: Optional[str], allowed: set) -> Optional[dict]:
+    """Projection for a comma-separated `fields=` parameter; None returns whole documents."""
+    if fields is None:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    if not requested:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No fields requested")
+    unknown = requested - allowed
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return {"_id": 0, **dict.fromkeys(sorted(requested), 1)}
+
+# ===== HOT DATA =====
+SETTINGS_CACHE_TTL_SECONDS = float(os.environ.get('SETTINGS_CACHE_TTL_SECONDS', '30'))
+
+_settings_cache = {"value": None, "loaded_at": 0.0}
+
+async def load_settings() -> Optional[dict]:
+    """Settings are read on every card request, so keep a short-lived copy in process."""
+    now = time.monotonic()
+    if _settings_cache["loaded_at"] and now - _settings_cache["loaded_at"] < SETTINGS_CACHE_TTL_SECONDS:
+        return _settings_cache["value"]
+    settings = await db.settings.find_one({}, {"_id": 0})
+    _settings_cache["value"] = settings
+    _settings_cache["loaded_at"] = now
+    return settings
+
+def invalidate_settings_cache():
+    _settings_cache["value"] = None
+    _settings_cache["loaded_at"] = 0.0
+
 # ===== AUTH HELPERS =====
 def hash_password(password: str) -> str:
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -124,29 +423,158 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, password_hash: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
 
-def create_token(user_id: str, email: str, role: str) -> str:
+class JWTKeyring:
+    """Signing keys by `kid`. Rotating JWT_KEYS_FILE takes effect without a restart."""
+
+    def __init__(self):
+        self.active_kid = JWT_DEFAULT_KID
+        self.keys = {JWT_DEFAULT_KID: JWT_SECRET}
+        self._mtime = None
+        self._checked_at = 0.0
+
+    def refresh(self, force: bool = False):
+        if not JWT_KEYS_FILE:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked_at < JWT_KEYS_RELOAD_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(JWT_KEYS_FILE).st_mtime
+            if mtime == self._mtime:
+                return
+            with open(JWT_KEYS_FILE) as f:
+                data = json.load(f)
+            keys = dict(data['keys'])
+            active_kid = data.get('active_kid', JWT_DEFAULT_KID)
+            if active_kid not in keys:
+                raise ValueError(f"active_kid {active_kid!r} has no key")
+        except (OSError, ValueError, KeyError) as e:
+            logging.getLogger(__name__).error(f"Failed to load JWT keys from {JWT_KEYS_FILE}: {e}")
+            return
+        self.keys = keys
+        self.active_kid = active_kid
+        self._mtime = mtime
+
+    def get(self, kid: str) -> Optional[str]:
+        self.refresh()
+        key = self.keys.get(kid)
+        if key is None:
+            # Tokens signed with a freshly rotated key may arrive before the periodic reload
+            self.refresh(force=True)
+            key = self.keys.get(kid)
+        return key
+
+jwt_keyring = JWTKeyring()
+
+# token -> (payload, kid, cached_until); skips signature checks for recently seen tokens
+_verified_tokens: "OrderedDict[str, tuple]" = OrderedDict()
+
+# user_id -> token epoch. Tokens carrying an older epoch have stale claims (role
+# change, block). Only epochs bumped within JWT_EXPIRATION_HOURS are kept: every
+# token issued before an older bump has expired anyway.
+token_epochs: dict = {}
+_token_epoch_bumped_at: dict = {}  # user_id -> when its epoch in token_epochs was bumped
+_token_epochs_state = {"loaded": False}
+
+def remember_token_epoch(user_id: str, epoch: int, bumped_at: datetime):
+    if epoch >= token_epochs.get(user_id, 0):
+        token_epochs[user_id] = epoch
+        _token_epoch_bumped_at[user_id] = bumped_at
+
+async def refresh_token_epochs():
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=JWT_EXPIRATION_HOURS)
+    docs = await db.users.find(
+        {"token_epoch_at": {"$gte": cutoff}},
+        {"_id": 0, "id": 1, "token_epoch": 1, "token_epoch_at": 1}
+    ).to_list(None)
+    # Merge rather than replace, so a bump made here while the query ran is kept
+    for d in docs:
+        remember_token_epoch(d['id'], d['token_epoch'], as_datetime(d['token_epoch_at']))
+    for user_id in [u for u, bumped_at in _token_epoch_bumped_at.items() if bumped_at < cutoff]:
+        token_epochs.pop(user_id, None)
+        del _token_epoch_bumped_at[user_id]
+    _token_epochs_state["loaded"] = True
+
+async def backfill_token_epoch_times():
+    """Epochs bumped before token_epoch_at existed count as bumped now, and age out from there."""
+    await db.users.update_many(
+        {"token_epoch": {"$gt": 0}, "token_epoch_at": None},
+        {"$set": {"token_epoch_at": datetime.now(timezone.utc)}}
+    )
+
+async def bump_token_epoch(user_id: str):
+    """Invalidate the claims of every token issued to the user so far."""
+    now = datetime.now(timezone.utc)
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        {"$inc": {"token_epoch": 1}, "$set": {"token_epoch_at": now}},
+        projection={"_id": 0, "id": 1, "token_epoch": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if user:
+        remember_token_epoch(user_id, user['token_epoch'], now)
+
+def create_token(user_id: str, email: str, role: str, epoch: int = 0) -> str:
+    now = datetime.now(timezone.utc)
     payload = {
         'user_id': user_id,
         'email': email,
         'role': role,
-        'exp': datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
+        'epoch': epoch,
+        'iat': now,
+        'exp': now + timedelta(hours=JWT_EXPIRATION_HOURS)
     }
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    jwt_keyring.refresh()
+    kid = jwt_keyring.active_kid
+    return jwt.encode(payload, jwt_keyring.keys[kid], algorithm=JWT_ALGORITHM, headers={'kid': kid})
 
 def decode_token(token: str) -> dict:
+    now = time.time()
+    cached = _verified_tokens.get(token)
+    if cached is not None:
+        payload, kid, cached_until = cached
+        jwt_keyring.refresh()
+        if now < cached_until and jwt_keyring.keys.get(kid) is not None:
+            _verified_tokens.move_to_end(token)
+            return payload
+        _verified_tokens.pop(token, None)
+
     try:
-        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        kid = jwt.get_unverified_header(token).get('kid', JWT_DEFAULT_KID)
+        key = jwt_keyring.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown key id {kid}")
+        payload = jwt.decode(token, key, algorithms=[JWT_ALGORITHM])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
+    _verified_tokens[token] = (payload, kid, min(now + JWT_VERIFY_CACHE_TTL_SECONDS, payload['exp']))
+    if len(_verified_tokens) > JWT_VERIFY_CACHE_SIZE:
+        _verified_tokens.popitem(last=False)
+    return payload
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     token = credentials.credentials
     payload = decode_token(token)
+
+    # Fast path: claims are current, so authorise without touching MongoDB
+    epoch = payload.get('epoch')
+    if epoch is not None and _token_epochs_state["loaded"] and epoch >= token_epochs.get(payload['user_id'], 0):
+        return {
+            "id": payload['user_id'],
+            "email": payload['email'],
+            "role": payload['role'],
+            "is_blocked": False
+        }
+
     user = await db.users.find_one({"id": payload['user_id']}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    if user.get('is_blocked', False):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Account is blocked")
     return user
 
 async def require_trader(user: dict = Depends(get_current_user)) -> dict:
@@ -159,6 +587,244 @@ async def require_admin(user: dict = Depends(get_current_user)) -> dict:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
     return user
 
+# Not cached across requests: the profile carries usdt_balance, which other
+# processes change. FastAPI's dependency cache already reads it once per request.
+async def get_trader_for_user(user_id: str) -> Optional[dict]:
+    return await db.traders.find_one({"user_id": user_id}, {"_id": 0})
+
+async def resolve_trader_profile(user: dict = Depends(require_trader)) -> Optional[dict]:
+    """Trader profile of the caller, looked up at most once per request."""
+    return await get_trader_for_user(user['id'])
+
+async def require_trader_profile(trader: Optional[dict] = Depends(resolve_trader_profile)) -> dict:
+    if not trader:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trader profile not found")
+    return trader
+
+# ===== OUTBOX =====
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '100'))
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', '1'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '10'))
+OUTBOX_LEASE_SECONDS = float(os.environ.get('OUTBOX_LEASE_SECONDS', '30'))
+OUTBOX_SINK_TIMEOUT_SECONDS = float(os.environ.get('OUTBOX_SINK_TIMEOUT_SECONDS', '10'))
+OUTBOX_RETENTION_DAYS = int(os.environ.get('OUTBOX_RETENTION_DAYS', '7'))
+OUTBOX_WEBHOOK_URL = os.environ.get('OUTBOX_WEBHOOK_URL')
+OUTBOX_WORKER_ID = str(uuid.uuid4())
+
+# Transactions and causal sessions both need a replica set or mongos
+mongo_topology = {"transactions": False, "sessions": False}
+outbox_wakeup = asyncio.Event()
+
+def outbox_event(event_type: str, aggregate_id: str, payload: dict) -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        "id": str(uuid.uuid4()),
+        "type": event_type,
+        "aggregate_id": aggregate_id,
+        "payload": payload,
+        "status": "pending",  # pending, processing, delivered, dead
+        "attempts": 0,
+        "delivered_to": [],
+        "created_at": now,
+        "next_attempt_at": now
+    }
+
+async def write_with_outbox(events: List[dict], operation):
+    """Apply `operation(session)` and enqueue `events` in the same unit of work.
+
+    On a replica set both go into one multi-document transaction, so an
+    exception from `operation` drops the events too. A standalone server has
+    no transactions; the events are then written right after the change.
+    """
+    if mongo_topology["transactions"]:
+        async with await client.start_session() as session:
+            async with session.start_transaction():
+                result = await operation(session)
+                await db.outbox.insert_many(events, session=session)
+    else:
+        result = await operation(None)
+        await db.outbox.insert_many(events)
+    outbox_wakeup.set()
+    return result
+
+# A sink's deliver() raises when the whole batch failed, or returns
+# {event_id: error} for the events it rejected; the others count as delivered.
+
+class LogSink:
+    name = "log"
+
+    async def deliver(self, events: List[dict]):
+        for event in events:
+            logger.info(f"Outbox event {event['type']} {event['aggregate_id']}")
+
+class SubscriberSink:
+    """In-process subscribers keyed by event type; "*" receives everything.
+
+    Delivery is at-least-once, so handlers must be idempotent on event['id'].
+    """
+
+    name = "subscribers"
+
+    def __init__(self):
+        self.handlers: dict = {}
+
+    def subscribe(self, event_type: str):
+        def register(handler):
+            self.handlers.setdefault(event_type, []).append(handler)
+            return handler
+        return register
+
+    async def deliver(self, events: List[dict]) -> dict:
+        rejected = {}
+        for event in events:
+            for handler in self.handlers.get(event['type'], []) + self.handlers.get("*", []):
+                try:
+                    await handler(event)
+                except Exception as e:
+                    rejected[event['id']] = f"{handler.__name__}: {e}"
+                    break
+        return rejected
+
+class WebhookSink:
+    """POSTs each batch as JSON to OUTBOX_WEBHOOK_URL."""
+
+    name = "webhook"
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def _post(self, body: bytes):
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=OUTBOX_SINK_TIMEOUT_SECONDS) as response:
+            response.read()
+
+    async def deliver(self, events: List[dict]):
+        body = json.dumps([
+            {k: event[k] for k in ("id", "type", "aggregate_id", "payload", "created_at")}
+            for event in events
+        ], default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value)).encode()
+        await asyncio.to_thread(self._post, body)
+
+subscribers = SubscriberSink()
+outbox_sinks = [LogSink(), subscribers] + ([WebhookSink(OUTBOX_WEBHOOK_URL)] if OUTBOX_WEBHOOK_URL else [])
+
+@subscribers.subscribe("*")
+async def record_audit_log(event: dict):
+    await db.audit_log.update_one(
+        {"event_id": event['id']},
+        {"$setOnInsert": {
+            "event_id": event['id'],
+            "type": event['type'],
+            "aggregate_id": event['aggregate_id'],
+            "payload": event['payload'],
+            "created_at": event['created_at']
+        }},
+        upsert=True
+    )
+
+@subscribers.subscribe("transaction.user_confirmed")
+async def notify_trader_of_payment(event: dict):
+    payload = event['payload']
+    await db.notifications.update_one(
+        {"event_id": event['id']},
+        {"$setOnInsert": {
+            "id": str(uuid.uuid4()),
+            "event_id": event['id'],
+            "trader_id": payload['trader_id'],
+            "transaction_id": event['aggregate_id'],
+            "message": f"User confirmed payment of {payload['amount']} {payload['currency']}",
+            "read": False,
+            "created_at": event['created_at']
+        }},
+        upsert=True
+    )
+
+async def claim_outbox_batch() -> List[dict]:
+    now = datetime.now(timezone.utc)
+    claimable = {"$or": [
+        {"status": "pending", "next_attempt_at": {"$lte": now}},
+        {"status": "processing", "lease_until": {"$lt": now}}
+    ]}
+    candidates = await db.outbox.find(claimable, {"_id": 0, "id": 1}).sort("created_at", 1).to_list(OUTBOX_BATCH_SIZE)
+    if not candidates:
+        return []
+    ids = [c['id'] for c in candidates]
+    await db.outbox.update_many(
+        {"id": {"$in": ids}, **claimable},
+        {"$set": {
+            "status": "processing",
+            "lease_owner": OUTBOX_WORKER_ID,
+            "lease_until": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        }}
+    )
+    return await db.outbox.find(
+        {"id": {"$in": ids}, "status": "processing", "lease_owner": OUTBOX_WORKER_ID},
+        {"_id": 0}
+    ).sort("created_at", 1).to_list(None)
+
+async def drain_outbox_batch() -> int:
+    batch = await claim_outbox_batch()
+    if not batch:
+        return 0
+
+    errors = {}
+    for sink in outbox_sinks:
+        pending = [e for e in batch if sink.name not in e['delivered_to'] and e['id'] not in errors]
+        if not pending:
+            continue
+        try:
+            # asyncio.timeout rather than wait_for: on 3.11 wait_for drops a
+            # cancel() that lands as the delivery finishes, and the consumer
+            # then never stops
+            async with asyncio.timeout(OUTBOX_SINK_TIMEOUT_SECONDS):
+                rejected = await sink.deliver(pending) or {}
+        except Exception as e:
+            logger.warning(f"Outbox sink {sink.name} failed for {len(pending)} events: {e}")
+            rejected = {event['id']: str(e) for event in pending}
+        else:
+            if rejected:
+                logger.warning(f"Outbox sink {sink.name} rejected {len(rejected)} of {len(pending)} events")
+        for event in pending:
+            if event['id'] in rejected:
+                errors[event['id']] = f"{sink.name}: {rejected[event['id']]}"
+            else:
+                event['delivered_to'].append(sink.name)
+
+    now = datetime.now(timezone.utc)
+    updates = []
+    for event in batch:
+        if event['id'] not in errors:
+            update = {"status": "delivered", "delivered_at": now, "delivered_to": event['delivered_to']}
+        else:
+            attempts = event['attempts'] + 1
+            update = {
+                "status": "dead" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending",
+                "attempts": attempts,
+                "delivered_to": event['delivered_to'],
+                "last_error": errors[event['id']],
+                "next_attempt_at": now + timedelta(seconds=min(2 ** attempts, 300))
+            }
+        updates.append(UpdateOne({"id": event['id'], "lease_owner": OUTBOX_WORKER_ID}, {"$set": update}))
+    await db.outbox.bulk_write(updates, ordered=False)
+    return len(batch)
+
+async def outbox_consumer():
+    while True:
+        try:
+            drained = await drain_outbox_batch()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Outbox consumer error: {e}")
+            drained = 0
+        if drained < OUTBOX_BATCH_SIZE:
+            outbox_wakeup.clear()
+            try:
+                async with asyncio.timeout(OUTBOX_POLL_SECONDS):
+                    await outbox_wakeup.wait()
+            except TimeoutError:
+                pass
+
 # ===== AUTH ROUTES =====
 @api_router.post("/auth/register")
 async def register(data: UserRegister):
@@ -185,14 +851,14 @@ async def login(data: UserLogin):
     if user.get('is_blocked', False):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Account is blocked")
     
-    token = create_token(user['id'], user['email'], user['role'])
+    token = create_token(user['id'], user['email'], user['role'], epoch=user.get('token_epoch', 0))
     return {"token": token, "user": {"id": user['id'], "email": user['email'], "role": user['role']}}
 
 @api_router.get("/auth/me")
 async def get_me(user: dict = Depends(get_current_user)):
     trader = None
     if user['role'] in ['trader', 'admin']:
-        trader = await db.traders.find_one({"user_id": user['id']}, {"_id": 0})
+        trader = await get_trader_for_user(user['id'])
     
     return {
         "id": user['id'],
@@ -222,36 +888,33 @@ async def become_trader(data: TraderRegister, user: dict = Depends(get_current_u
     
     # Update user role
     await db.users.update_one({"id": user['id']}, {"$set": {"role": "trader"}})
+    await bump_token_epoch(user['id'])
     
     return trader
 
 @api_router.get("/trader/profile")
-async def get_trader_profile(user: dict = Depends(require_trader)):
-    trader = await db.traders.find_one({"user_id": user['id']}, {"_id": 0})
-    if not trader:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trader profile not found")
+async def get_trader_profile(trader: dict = Depends(require_trader_profile)):
     return trader
 
 @api_router.post("/trader/cards")
-async def add_card(data: CardCreate, user: dict = Depends(require_trader)):
-    trader = await db.traders.find_one({"user_id": user['id']}, {"_id": 0})
-    if not trader:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trader profile not found")
-    
+async def add_card(data: CardCreate, trader: dict = Depends(require_trader_profile)):
+    validate_limit_period(data.limit_period)
     card = Card(
         trader_id=trader['id'],
         card_number=data.card_number,
         bank_name=data.bank_name,
         holder_name=data.holder_name,
         limit=data.limit,
-        currency=data.currency
+        currency=data.currency,
+        limit_period=data.limit_period,
+        window_start=card_window_start(data.limit_period, datetime.now(timezone.utc))
     )
     await db.cards.insert_one(card.model_dump())
+    signal_card_capacity(card.currency)
     return card
 
 @api_router.get("/trader/cards")
-async def get_trader_cards(user: dict = Depends(require_trader)):
-    trader = await db.traders.find_one({"user_id": user['id']}, {"_id": 0})
+async def get_trader_cards(trader: Optional[dict] = Depends(resolve_trader_profile)):
     if not trader:
         return []
     
@@ -259,27 +922,42 @@ async def get_trader_cards(user: dict = Depends(require_trader)):
     return cards
 
 @api_router.put("/trader/cards/{card_id}")
-async def update_card(card_id: str, data: CardUpdate, user: dict = Depends(require_trader)):
-    trader = await db.traders.find_one({"user_id": user['id']}, {"_id": 0})
-    if not trader:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trader profile not found")
-    
-    card = await db.cards.find_one({"id": card_id, "trader_id": trader['id']}, {"_id": 0})
-    if not card:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Card not found")
-    
+async def update_card(card_id: str, data: CardUpdate, trader: dict = Depends(require_trader_profile)):
     update_data = {k: v for k, v in data.model_dump().items() if v is not None}
-    await db.cards.update_one({"id": card_id}, {"$set": update_data})
-    
-    updated_card = await db.cards.find_one({"id": card_id}, {"_id": 0})
+    card_filter = {"id": card_id, "trader_id": trader['id']}
+    if data.limit_period is not None:
+        validate_limit_period(data.limit_period)
+        card = await db.cards.find_one(card_filter, {"_id": 0, "limit_period": 1, "current_usage": 1})
+        if not card:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Card not found")
+        if card.get('limit_period', "none") != data.limit_period:
+            # The usage so far carries over into the new window, so switching
+            # periods cannot be used to reset a limit
+            now = datetime.now(timezone.utc)
+            update_data["window_start"] = card_window_start(data.limit_period, now)
+            update_data["usage_buckets"] = (
+                {usage_bucket_key(now): card['current_usage']} if data.limit_period == "rolling_24h" else {}
+            )
+            card_filter["current_usage"] = card['current_usage']
+    if update_data:
+        updated_card = await db.cards.find_one_and_update(
+            card_filter,
+            {"$set": update_data},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+    else:
+        updated_card = await db.cards.find_one(card_filter, {"_id": 0})
+    if not updated_card and "current_usage" in card_filter:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Card was used meanwhile, retry")
+    if not updated_card:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Card not found")
+    if update_data:
+        signal_card_capacity(updated_card['currency'])
     return updated_card
 
 @api_router.delete("/trader/cards/{card_id}")
-async def delete_card(card_id: str, user: dict = Depends(require_trader)):
-    trader = await db.traders.find_one({"user_id": user['id']}, {"_id": 0})
-    if not trader:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trader profile not found")
-    
+async def delete_card(card_id: str, trader: dict = Depends(require_trader_profile)):
     result = await db.cards.delete_one({"id": card_id, "trader_id": trader['id']})
     if result.deleted_count == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Card not found")
@@ -287,26 +965,59 @@ async def delete_card(card_id: str, user: dict = Depends(require_trader)):
     return {"message": "Card deleted successfully"}
 
 @api_router.get("/trader/transactions")
-async def get_trader_transactions(user: dict = Depends(require_trader)):
-    trader = await db.traders.find_one({"user_id": user['id']}, {"_id": 0})
+async def get_trader_transactions(
+    include_archived: bool = False,
+    fields: Optional[str] = None,
+    trader: Optional[dict] = Depends(resolve_trader_profile)
+):
     if not trader:
         return []
     
-    transactions = await db.transactions.find({"trader_id": trader['id']}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    projection = sparse_projection(fields, TRADER_TRANSACTION_FIELDS)
+    card_projection = {"_id": 0}
+    embed_card, keep_card_id, keep_card_key = True, True, True
+    if projection is not None:
+        # card and card.<field> select the embedded card, not transaction fields
+        card_paths = [path for path in projection if path == "card" or path.startswith("card.")]
+        for path in card_paths:
+            del projection[path]
+        embed_card = bool(card_paths)
+        keep_card_id = "card_id" in projection
+        if embed_card:
+            projection["card_id"] = 1
+        if card_paths and "card" not in card_paths:
+            card_projection = {"_id": 0, "id": 1, **{path[len("card."):]: 1 for path in card_paths}}
+            keep_card_key = "card.id" in card_paths
+    
+    transactions = await find_transactions(
+        {"trader_id": trader['id']}, include_archived=include_archived, projection=projection
+    )
+    if not embed_card:
+        return transactions
     
-    # Enrich with card info
+    # Enrich with card info in a single query
+    card_ids = list({txn['card_id'] for txn in transactions})
+    cards = await db.cards.find({"id": {"$in": card_ids}}, card_projection).to_list(None) if card_ids else []
+    cards_by_id = {card['id']: card for card in cards}
     for txn in transactions:
-        card = await db.cards.find_one({"id": txn['card_id']}, {"_id": 0})
+        card = cards_by_id.get(txn['card_id'])
+        if card is not None and not keep_card_key:
+            card = {k: v for k, v in card.items() if k != 'id'}
         txn['card'] = card
+        if not keep_card_id:
+            del txn['card_id']
     
     return transactions
 
+@api_router.get("/trader/notifications")
+async def get_trader_notifications(trader: dict = Depends(require_trader_profile)):
+    notifications = await db.notifications.find(
+        {"trader_id": trader['id']}, {"_id": 0, "event_id": 0}
+    ).sort("created_at", -1).to_list(50)
+    return notifications
+
 @api_router.post("/trader/confirm-payment/{transaction_id}")
-async def trader_confirm_payment(transaction_id: str, user: dict = Depends(require_trader)):
-    trader = await db.traders.find_one({"user_id": user['id']}, {"_id": 0})
-    if not trader:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trader profile not found")
-    
+async def trader_confirm_payment(transaction_id: str, trader: dict = Depends(require_trader_profile)):
     txn = await db.transactions.find_one({"id": transaction_id, "trader_id": trader['id']}, {"_id": 0})
     if not txn:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found")
@@ -315,7 +1026,7 @@ async def trader_confirm_payment(transaction_id: str, user: dict = Depends(requi
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User must confirm payment first")
     
     # Get settings
-    settings = await db.settings.find_one({}, {"_id": 0})
+    settings = await load_settings()
     commission_rate = settings['commission_rate'] if settings else 9.0
     usd_to_uah_rate = settings['usd_to_uah_rate'] if settings else 41.5
     
@@ -325,23 +1036,55 @@ async def trader_confirm_payment(transaction_id: str, user: dict = Depends(requi
     amount_without_commission = txn['amount'] / (1 + commission_rate / 100)
     usdt_to_send = amount_without_commission / usd_to_uah_rate
     
-    # Check trader balance
-    if trader['usdt_balance'] < usdt_to_send:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient USDT balance")
-    
-    # Update trader balance (списываем USDT у трейдера)
-    new_balance = trader['usdt_balance'] - usdt_to_send
-    await db.traders.update_one({"id": trader['id']}, {"$set": {"usdt_balance": new_balance}})
+    # Списываем USDT у трейдера, only if the balance still covers it, and complete
+    # the transaction in the same unit of work. Without a multi-document
+    # transaction each write is durable on its own, so note what to undo.
+    debited_alone = False
+    completed_alone = False
+    async def complete(session):
+        nonlocal debited_alone, completed_alone
+        debited = await db.traders.update_one(
+            {"id": trader['id'], "usdt_balance": {"$gte": usdt_to_send}},
+            {"$inc": {"usdt_balance": -usdt_to_send}},
+            session=session
+        )
+        if debited.modified_count == 0:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient USDT balance")
+        debited_alone = session is None
+        result = await db.transactions.update_one(
+            {"id": transaction_id, "status": "user_confirmed"},
+            {"$set": {
+                "status": "completed",
+                "completed_at": datetime.now(timezone.utc),
+                "usdt_amount": usdt_to_send
+            }},
+            session=session
+        )
+        if result.modified_count == 0:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Transaction already processed")
+        completed_alone = session is None
     
-    # Update transaction
-    await db.transactions.update_one(
-        {"id": transaction_id},
-        {"$set": {
-            "status": "completed",
-            "completed_at": datetime.now(timezone.utc).isoformat(),
-            "usdt_amount": usdt_to_send
-        }}
-    )
+    try:
+        await write_with_outbox(
+            [outbox_event("transaction.completed", transaction_id, {
+                "user_id": txn['user_id'],
+                "trader_id": trader['id'],
+                "amount": txn['amount'],
+                "currency": txn['currency'],
+                "usdt_amount": usdt_to_send
+            })],
+            complete
+        )
+    except Exception:
+        if completed_alone:
+            # The completed event was never enqueued; leave it for a retry
+            await db.transactions.update_one(
+                {"id": transaction_id, "status": "completed"},
+                {"$set": {"status": "user_confirmed"}, "$unset": {"completed_at": "", "usdt_amount": ""}}
+            )
+        if debited_alone:
+            await db.traders.update_one({"id": trader['id']}, {"$inc": {"usdt_balance": usdt_to_send}})
+        raise
     
     return {
         "message": "Payment confirmed and USDT sent",
@@ -350,6 +1093,435 @@ async def trader_confirm_payment(transaction_id: str, user: dict = Depends(requi
         "rate": usd_to_uah_rate
     }
 
+# ===== CARD LIMIT WINDOWS =====
+# current_usage is the usage of the card's current window, so allocation checks
+# headroom against it directly. Windows start at UTC period boundaries; a
+# rolling_24h card keeps hourly usage buckets and its window is the last 24 of them.
+CARD_LIMIT_PERIODS = ("none", "daily", "monthly", "rolling_24h")
+CARD_ROLLOVER_MAX_SLEEP_SECONDS = float(os.environ.get('CARD_ROLLOVER_MAX_SLEEP_SECONDS', '300'))
+
+def card_window_start(period: str, now: datetime) -> Optional[datetime]:
+    hour = now.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if period == "daily":
+        return hour.replace(hour=0)
+    if period == "monthly":
+        return hour.replace(day=1, hour=0)
+    if period == "rolling_24h":
+        return hour - timedelta(hours=23)
+    return None
+
+def usage_bucket_key(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime("%Y%m%d%H")
+
+def card_window_is_stale(card: dict, now: datetime) -> bool:
+    period = card.get('limit_period', "none")
+    if period == "none":
+        return False
+    window_start = card.get('window_start')
+    return window_start is None or as_datetime(window_start) < card_window_start(period, now)
+
+def validate_limit_period(period: str):
+    if period not in CARD_LIMIT_PERIODS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"limit_period must be one of: {', '.join(CARD_LIMIT_PERIODS)}"
+        )
+
+async def roll_card_limits(now: Optional[datetime] = None) -> int:
+    """Move every card whose window has passed into the current one, one bulk update per period.
+
+    Daily and monthly cards start again from zero; rolling_24h cards drop the
+    buckets that left the window and recount current_usage from the rest.
+    Windows only move forward: a process whose clock lags behind a boundary
+    another process already rolled matches nothing.
+    """
+    now = now or datetime.now(timezone.utc)
+    rolled = 0
+    for period in ("daily", "monthly"):
+        start = card_window_start(period, now)
+        result = await db.cards.update_many(
+            {"limit_period": period, "$or": [{"window_start": None}, {"window_start": {"$lt": start}}]},
+            {"$set": {"current_usage": 0.0, "window_start": start, "usage_buckets": {}}}
+        )
+        rolled += result.modified_count
+    start = card_window_start("rolling_24h", now)
+    result = await db.cards.update_many(
+        {"limit_period": "rolling_24h", "$or": [{"window_start": None}, {"window_start": {"$lt": start}}]},
+        [
+            {"$set": {"_window": {"$filter": {
+                "input": {"$objectToArray": "$usage_buckets"},
+                "as": "bucket",
+                "cond": {"$gte": ["$$bucket.k", usage_bucket_key(start)]}
+            }}}},
+            {"$set": {
+                "usage_buckets": {"$arrayToObject": "$_window"},
+                "current_usage": {"$sum": "$_window.v"},
+                "window_start": start
+            }},
+            {"$project": {"_window": 0}}
+        ]
+    )
+    rolled += result.modified_count
+    if rolled:
+        for currency in card_queue.currencies():
+            signal_card_capacity(currency)
+    return rolled
+
+async def card_limit_roller():
+    # Every window boundary is on the hour, so wake just after each one
+    while True:
+        try:
+            rolled = await roll_card_limits()
+            if rolled:
+                logger.info(f"Rolled limit windows of {rolled} cards")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Card limit rollover failed: {e}")
+        now = datetime.now(timezone.utc)
+        next_hour = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        await asyncio.sleep(min(CARD_ROLLOVER_MAX_SLEEP_SECONDS, (next_hour - now).total_seconds() + 0.5))
+
+# ===== CARD MATCHING =====
+CARD_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('CARD_QUEUE_TIMEOUT_SECONDS', '15'))
+CARD_QUEUE_POLICY = os.environ.get('CARD_QUEUE_POLICY', 'fifo')  # fifo, amount
+CARD_QUEUE_MAX_SKIPS = int(os.environ.get('CARD_QUEUE_MAX_SKIPS', '5'))
+CARD_QUEUE_MAX_DEPTH = int(os.environ.get('CARD_QUEUE_MAX_DEPTH', '1000'))
+# The sweep is also how waiters see capacity freed by other processes, so it
+# has to run several times within CARD_QUEUE_TIMEOUT_SECONDS
+EXPIRY_SWEEP_SECONDS = float(os.environ.get('EXPIRY_SWEEP_SECONDS', '5'))
+
+class _CardWaiter:
+    __slots__ = ("amount", "future", "skips")
+
+    def __init__(self, amount: float, future: asyncio.Future):
+        self.amount = amount
+        self.future = future
+        self.skips = 0
+
+class CardMatchingQueue:
+    """Per-currency waiting room for card requests that found no headroom.
+
+    notify() is given the free headroom of every active card and wakes the
+    waiters it can serve, reserving capacity as it goes so that one freed
+    card wakes one request instead of all of them. With the "fifo" policy the
+    head of the queue blocks everyone behind it; with "amount" smaller
+    requests may overtake a request that does not fit, but only
+    CARD_QUEUE_MAX_SKIPS times before it is served first. A request larger
+    than every active card's limit can never fit and is turned away under
+    either policy, so it cannot hold up the queue.
+    """
+
+    def __init__(self, policy: str = CARD_QUEUE_POLICY, max_skips: int = CARD_QUEUE_MAX_SKIPS,
+                 max_depth: int = CARD_QUEUE_MAX_DEPTH):
+        self.policy = policy
+        self.max_skips = max_skips
+        self.max_depth = max_depth
+        self._waiters: dict = {}
+        self.stats = {"enqueued": 0, "woken": 0, "timed_out": 0, "rejected": 0, "unservable": 0,
+                      "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+
+    def depth(self, currency: Optional[str] = None) -> int:
+        if currency is not None:
+            return len(self._waiters.get(currency, ()))
+        return sum(len(w) for w in self._waiters.values())
+
+    def currencies(self) -> List[str]:
+        return [currency for currency, waiters in self._waiters.items() if waiters]
+
+    async def wait(self, currency: str, amount: float, timeout: float, front: bool = False) -> bool:
+        """Wait until notify() reserves capacity for `amount`. False on timeout, a full queue or an unservable amount."""
+        waiters = self._waiters.setdefault(currency, deque())
+        if len(waiters) >= self.max_depth:
+            self.stats["rejected"] += 1
+            return False
+        waiter = _CardWaiter(amount, asyncio.get_running_loop().create_future())
+        if front:
+            waiters.appendleft(waiter)
+        else:
+            waiters.append(waiter)
+        self.stats["enqueued"] += 1
+        started = time.monotonic()
+        try:
+            woken = await asyncio.wait_for(waiter.future, timeout)
+            outcome = "woken" if woken else "unservable"
+        except asyncio.TimeoutError:
+            woken = False
+            outcome = "timed_out"
+        finally:
+            if waiter in waiters:
+                waiters.remove(waiter)
+        waited_ms = (time.monotonic() - started) * 1000
+        self.stats[outcome] += 1
+        self.stats["total_wait_ms"] += waited_ms
+        self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], waited_ms)
+        return woken
+
+    def notify(self, currency: str, headroom: List[float], largest_limit: Optional[float] = None) -> int:
+        waiters = self._waiters.get(currency)
+        if not waiters:
+            return 0
+        headroom = list(headroom)
+        woken = 0
+        for waiter in list(waiters):
+            if waiter.future.done():
+                continue
+            if largest_limit is not None and waiter.amount > largest_limit:
+                waiters.remove(waiter)
+                waiter.future.set_result(False)
+                continue
+            slot = next((i for i, free in enumerate(headroom) if free >= waiter.amount), None)
+            if slot is None:
+                if self.policy != "amount" or waiter.skips >= self.max_skips:
+                    break
+                waiter.skips += 1
+                continue
+            headroom[slot] -= waiter.amount
+            waiters.remove(waiter)
+            waiter.future.set_result(True)
+            woken += 1
+        return woken
+
+    def snapshot(self) -> dict:
+        finished = self.stats["woken"] + self.stats["timed_out"] + self.stats["unservable"]
+        return {
+            "policy": self.policy,
+            "depth": {currency: len(waiters) for currency, waiters in self._waiters.items()},
+            **self.stats,
+            "total_wait_ms": round(self.stats["total_wait_ms"], 1),
+            "max_wait_ms": round(self.stats["max_wait_ms"], 1),
+            "avg_wait_ms": round(self.stats["total_wait_ms"] / finished, 1) if finished else 0.0
+        }
+
+card_queue = CardMatchingQueue()
+allocation_stats = {"attempts": 0, "failed": 0, "lost_races": 0}
+_capacity_signals: set = set()
+
+async def active_cards(currency: str) -> List[dict]:
+    # Always read fresh: usage changes with every claim, in this process or another
+    return await db.cards.find({"status": "active", "currency": currency}, {"_id": 0}).to_list(1000)
+
+async def claim_card(currency: str, amount: float, now: Optional[datetime] = None):
+    """Atomically reserve `amount` on an active card.
+
+    Returns (card, largest_limit); largest_limit is None without active cards.
+    """
+    allocation_stats["attempts"] += 1
+    now = now or datetime.now(timezone.utc)
+    cards = await active_cards(currency)
+    # A window boundary passed before the roller got to it; roll now rather than
+    # reserve against the old window
+    if any(card_window_is_stale(card, now) for card in cards):
+        await roll_card_limits(now)
+        cards = await active_cards(currency)
+    
+    for card in cards:
+        if (card['limit'] - card['current_usage']) < amount:
+            continue
+        period = card.get('limit_period', "none")
+        claim_filter = {
+            "id": card['id'],
+            "status": "active",
+            "$expr": {"$gte": [{"$subtract": ["$limit", "$current_usage"]}, amount]}
+        }
+        increments = {"current_usage": amount}
+        if period != "none":
+            # A window newer than this process's clock is still the current one
+            claim_filter["window_start"] = {"$gte": card_window_start(period, now)}
+        if period == "rolling_24h":
+            increments[f"usage_buckets.{usage_bucket_key(now)}"] = amount
+        result = await db.cards.update_one(claim_filter, {"$inc": increments})
+        if result.modified_count:
+            return card, card_limit_ceiling(cards)
+        allocation_stats["lost_races"] += 1
+    
+    allocation_stats["failed"] += 1
+    return None, card_limit_ceiling(cards)
+
+def card_limit_ceiling(cards: List[dict]) -> Optional[float]:
+    return max((card['limit'] for card in cards), default=None)
+
+async def largest_card_limit(currency: str) -> Optional[float]:
+    cards = await db.cards.find(
+        {"status": "active", "currency": currency}, {"_id": 0, "limit": 1}
+    ).sort("limit", -1).limit(1).to_list(1)
+    return card_limit_ceiling(cards)
+
+async def release_card_usage(card_id: str, amount: float, currency: str, allocated_at: datetime):
+    # Usage allocated in a window that has since rolled over is already gone
+    in_window = {"id": card_id, "$or": [{"window_start": None}, {"window_start": {"$lte": allocated_at}}]}
+    result = await db.cards.update_one(
+        {**in_window, "limit_period": {"$ne": "rolling_24h"}},
+        {"$inc": {"current_usage": -amount}}
+    )
+    if not result.matched_count:
+        bucket = f"usage_buckets.{usage_bucket_key(allocated_at)}"
+        await db.cards.update_one(
+            {**in_window, bucket: {"$exists": True}},
+            {"$inc": {"current_usage": -amount, bucket: -amount}}
+        )
+    signal_card_capacity(currency)
+
+async def _wake_card_waiters(currency: str):
+    cards = await db.cards.find(
+        {"status": "active", "currency": currency},
+        {"_id": 0, "limit": 1, "current_usage": 1}
+    ).to_list(1000)
+    card_queue.notify(currency, [card['limit'] - card['current_usage'] for card in cards], card_limit_ceiling(cards))
+
+def signal_card_capacity(currency: str):
+    """Capacity may have freed up; wake matching waiters without delaying the caller."""
+    if not card_queue.depth(currency):
+        return
+    task = asyncio.create_task(_wake_card_waiters(currency))
+    _capacity_signals.add(task)
+    task.add_done_callback(_capacity_signals.discard)
+
+async def expire_pending_transactions() -> int:
+    now = datetime.now(timezone.utc)
+    expired = await db.transactions.find(
+        {"status": "pending", **before_date("expires_at", now)},
+        {"_id": 0, "id": 1, "user_id": 1, "trader_id": 1, "card_id": 1, "amount": 1, "currency": 1, "created_at": 1}
+    ).to_list(500)
+    
+    cancelled = 0
+    for txn in expired:
+        allocated_at = as_datetime(txn.pop('created_at'))
+        # Without a multi-document transaction the cancel is durable before the outbox write
+        cancelled_alone = False
+        async def cancel(session, txn=txn):
+            nonlocal cancelled_alone
+            result = await db.transactions.update_one(
+                {"id": txn['id'], "status": "pending"},
+                {"$set": {"status": "cancelled", "cancelled_at": now}},
+                session=session
+            )
+            if result.modified_count == 0:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Transaction already processed")
+            cancelled_alone = session is None
+        try:
+            await write_with_outbox([outbox_event("transaction.expired", txn['id'], txn)], cancel)
+        except HTTPException:
+            continue
+        except Exception as e:
+            logger.error(f"Expiring transaction {txn['id']} failed: {e}")
+            # Nothing was written; the next sweep retries it
+            if not cancelled_alone:
+                continue
+        await release_card_usage(txn['card_id'], txn['amount'], txn['currency'], allocated_at)
+        cancelled += 1
+    return cancelled
+
+async def expiry_sweeper():
+    while True:
+        try:
+            cancelled = await expire_pending_transactions()
+            if cancelled:
+                logger.info(f"Cancelled {cancelled} expired transactions")
+            # Capacity freed by other processes is only seen here
+            for currency in card_queue.currencies():
+                signal_card_capacity(currency)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Expiry sweep failed: {e}")
+        await asyncio.sleep(EXPIRY_SWEEP_SECONDS)
+
+# ===== TRANSACTION ARCHIVE =====
+ARCHIVE_AFTER_DAYS = float(os.environ.get('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '1000'))
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '3600'))
+SETTLED_STATUSES = ["completed", "cancelled"]
+ARCHIVE_COUNT_CACHE_SIZE = int(os.environ.get('ARCHIVE_COUNT_CACHE_SIZE', '1024'))
+ARCHIVE_COUNT_CACHE_TTL_SECONDS = float(os.environ.get('ARCHIVE_COUNT_CACHE_TTL_SECONDS', '60'))
+
+# The archive only changes when an archiver runs. This process clears the cache
+# after its own runs; the TTL bounds how stale a count from another worker's run can be.
+_archived_counts: "OrderedDict[str, tuple]" = OrderedDict()
+
+async def count_archived(query: dict, source=None, session=None) -> int:
+    key = json.dumps(query, sort_keys=True, default=str)
+    now = time.monotonic()
+    cached = _archived_counts.get(key)
+    if cached and cached[0] > now:
+        _archived_counts.move_to_end(key)
+        return cached[1]
+    count = await (source or db).transactions_archive.count_documents(query, session=session)
+    _archived_counts[key] = (now + ARCHIVE_COUNT_CACHE_TTL_SECONDS, count)
+    _archived_counts.move_to_end(key)
+    if len(_archived_counts) > ARCHIVE_COUNT_CACHE_SIZE:
+        _archived_counts.popitem(last=False)
+    return count
+
+async def count_transactions(query: dict, source=None, session=None) -> int:
+    """Count across the hot and archive tiers; `source` defaults to the primary `db`."""
+    source = source or db
+    hot, archived = await gather_reads(
+        session,
+        source.transactions.count_documents(query, session=session),
+        count_archived(query, source, session)
+    )
+    return hot + archived
+
+async def find_transactions(
+    query: dict, limit: int = 1000, include_archived: bool = False, skip: int = 0, source=None, session=None,
+    projection: Optional[dict] = None
+) -> List[dict]:
+    """Newest transactions first; with include_archived the archive tier is merged in."""
+    source = source or db
+    projection = projection or {"_id": 0}
+    if not include_archived:
+        return await source.transactions.find(query, projection, session=session).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    # The tiers are merged on created_at, so a sparse projection fetches it anyway
+    merge_projection = {**projection, "created_at": 1} if len(projection) > 1 else projection
+    # Either tier may hold the whole page, so read skip + limit from both and merge
+    hot, archived = await gather_reads(
+        session,
+        source.transactions.find(query, merge_projection, session=session).sort("created_at", -1).limit(skip + limit).to_list(None),
+        source.transactions_archive.find(query, merge_projection, session=session).sort("created_at", -1).limit(skip + limit).to_list(None)
+    )
+    page = heapq.nlargest(skip + limit, hot + archived, key=lambda txn: as_datetime(txn['created_at']))[skip:]
+    if merge_projection is not projection and "created_at" not in projection:
+        for txn in page:
+            del txn['created_at']
+    return page
+
+async def archive_settled_transactions() -> int:
+    """Move settled transactions older than ARCHIVE_AFTER_DAYS to transactions_archive.
+
+    Each batch is copied before it is deleted and the archive has a unique
+    index on id, so an interrupted run is safe to repeat.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    query = {"status": {"$in": SETTLED_STATUSES}, **before_date("created_at", cutoff)}
+    moved = 0
+    while True:
+        batch = await db.transactions.find(query, {"_id": 0}).limit(ARCHIVE_BATCH_SIZE).to_list(None)
+        if not batch:
+            break
+        ids = [txn['id'] for txn in batch]
+        try:
+            await db.transactions_archive.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+        await db.transactions.delete_many({"id": {"$in": ids}, "status": {"$in": SETTLED_STATUSES}})
+        _archived_counts.clear()
+        moved += len(batch)
+    return moved
+
+async def transaction_archiver():
+    while True:
+        try:
+            moved = await archive_settled_transactions()
+            if moved:
+                logger.info(f"Archived {moved} settled transactions")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Transaction archiving failed: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
 # ===== USER ROUTES =====
 @api_router.post("/user/request-card")
 async def request_card(data: TransactionRequest, user: dict = Depends(get_current_user)):
@@ -358,7 +1530,7 @@ async def request_card(data: TransactionRequest, user: dict = Depends(get_curren
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Amount must be positive")
     
     # Get settings for commission
-    settings = await db.settings.find_one({}, {"_id": 0})
+    settings = await load_settings()
     commission_rate = settings['commission_rate'] if settings else 9.0
     usd_to_uah_rate = settings['usd_to_uah_rate'] if settings else 41.5
     
@@ -368,40 +1540,66 @@ async def request_card(data: TransactionRequest, user: dict = Depends(get_curren
     uah_without_commission = data.amount * usd_to_uah_rate
     total_uah = uah_without_commission * (1 + commission_rate / 100)
     
-    # Find available card
-    cards = await db.cards.find({
-        "status": "active",
-        "currency": data.currency
-    }, {"_id": 0}).to_list(1000)
-    
-    if not cards:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No available cards")
-    
-    # Find card with sufficient limit
-    available_card = None
-    for card in cards:
-        if (card['limit'] - card['current_usage']) >= total_uah:
-            available_card = card
-            break
-    
-    if not available_card:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No card with sufficient limit")
+    # Claim a card, waiting in the currency queue while none has headroom. While
+    # others are already waiting, join the back of the queue instead of taking
+    # capacity that notify() may have reserved for them.
+    amount_uah = round(total_uah, 2)
+    deadline = time.monotonic() + CARD_QUEUE_TIMEOUT_SECONDS
+    requeue = False
+    while True:
+        claimed_at = datetime.now(timezone.utc)
+        if requeue or not card_queue.depth(data.currency):
+            available_card, largest_limit = await claim_card(data.currency, amount_uah, claimed_at)
+            if available_card:
+                break
+        else:
+            largest_limit = await largest_card_limit(data.currency)
+            # The queue only moves on signals; let it consider this request too
+            signal_card_capacity(data.currency)
+        # No card could ever take this amount, so waiting would only hold up the queue
+        if largest_limit is not None and amount_uah > largest_limit:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No card with sufficient limit")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not await card_queue.wait(data.currency, amount_uah, remaining, front=requeue):
+            if largest_limit is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No available cards")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No card with sufficient limit")
+        # Woken with capacity reserved for us; if someone else got it, retry from the front
+        requeue = True
     
     # Create transaction (сохраняем сумму UAH с комиссией)
     txn = Transaction(
         user_id=user['id'],
         trader_id=available_card['trader_id'],
         card_id=available_card['id'],
-        amount=round(total_uah, 2),
-        currency=data.currency
-    )
-    await db.transactions.insert_one(txn.model_dump())
-    
-    # Update card usage
-    await db.cards.update_one(
-        {"id": available_card['id']},
-        {"$set": {"current_usage": available_card['current_usage'] + total_uah}}
+        amount=amount_uah,
+        currency=data.currency,
+        created_at=claimed_at  # the card window the usage was counted in
     )
+    # Without a multi-document transaction the insert is durable before the
+    # outbox write, and a pending transaction still holds the card's usage
+    inserted_alone = False
+    async def insert(session):
+        nonlocal inserted_alone
+        await db.transactions.insert_one(txn.model_dump(), session=session)
+        inserted_alone = session is None
+    try:
+        await write_with_outbox(
+            [outbox_event("transaction.created", txn.id, {
+                "user_id": txn.user_id,
+                "trader_id": txn.trader_id,
+                "card_id": txn.card_id,
+                "amount": txn.amount,
+                "currency": txn.currency
+            })],
+            insert
+        )
+    except Exception:
+        if inserted_alone:
+            # If this delete fails too the transaction keeps the usage until it expires
+            await db.transactions.delete_one({"id": txn.id, "status": "pending"})
+        await release_card_usage(available_card['id'], amount_uah, data.currency, claimed_at)
+        raise
     
     return {
         "transaction_id": txn.id,
@@ -427,36 +1625,229 @@ async def user_confirm_payment(transaction_id: str, user: dict = Depends(get_cur
     if txn['status'] != 'pending':
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Transaction already processed")
     
-    await db.transactions.update_one(
-        {"id": transaction_id},
-        {"$set": {
-            "status": "user_confirmed",
-            "user_confirmed_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
+    # Without a multi-document transaction the confirmation is durable before the outbox write
+    confirmed_alone = False
+    async def confirm(session):
+        nonlocal confirmed_alone
+        result = await db.transactions.update_one(
+            {"id": transaction_id, "status": "pending"},
+            {"$set": {
+                "status": "user_confirmed",
+                "user_confirmed_at": datetime.now(timezone.utc)
+            }},
+            session=session
+        )
+        if result.modified_count == 0:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Transaction already processed")
+        confirmed_alone = session is None
+    
+    try:
+        await write_with_outbox(
+            [outbox_event("transaction.user_confirmed", transaction_id, {
+                "user_id": txn['user_id'],
+                "trader_id": txn['trader_id'],
+                "amount": txn['amount'],
+                "currency": txn['currency']
+            })],
+            confirm
+        )
+    except Exception:
+        if confirmed_alone:
+            # Without its event the trader is never notified; back to pending so the user can retry
+            await db.transactions.update_one(
+                {"id": transaction_id, "status": "user_confirmed"},
+                {"$set": {"status": "pending"}, "$unset": {"user_confirmed_at": ""}}
+            )
+        raise
     
     return {"message": "Payment confirmation sent to trader"}
 
 @api_router.get("/user/transactions")
-async def get_user_transactions(user: dict = Depends(get_current_user)):
-    transactions = await db.transactions.find({"user_id": user['id']}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+async def get_user_transactions(
+    include_archived: bool = False,
+    fields: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    projection = sparse_projection(fields, TRANSACTION_FIELDS)
+    transactions = await find_transactions(
+        {"user_id": user['id']}, include_archived=include_archived, projection=projection
+    )
     return transactions
 
+# ===== READ ROUTING =====
+def format_operation_time(operation_time: Timestamp) -> str:
+    return f"{operation_time.time}.{operation_time.inc}"
+
+def parse_operation_time(value: str) -> Timestamp:
+    try:
+        seconds, increment = value.split(".")
+        return Timestamp(int(seconds), int(increment))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid X-Read-After header")
+
+@asynccontextmanager
+async def causal_write(response: Response):
+    """Session for an admin write that later reporting reads may need to see.
+
+    Its operation time is returned as X-Operation-Time; sending that back as
+    X-Read-After makes a reporting read wait until its secondary has the write.
+    """
+    if not mongo_topology["sessions"]:
+        yield None
+        return
+    async with await db.client.start_session(causal_consistency=True) as session:
+        yield session
+        if session.operation_time is not None:
+            response.headers["X-Operation-Time"] = format_operation_time(session.operation_time)
+
+async def reporting_session(request: Request):
+    """Dependency: a causal session advanced to X-Read-After, or None without the header."""
+    read_after = request.headers.get("X-Read-After")
+    if not read_after:
+        yield None
+        return
+    operation_time = parse_operation_time(read_after)
+    if not mongo_topology["sessions"]:
+        # A standalone server has no secondaries to lag behind
+        yield None
+        return
+    async with await reporting_db.client.start_session(causal_consistency=True) as session:
+        session.advance_operation_time(operation_time)
+        yield session
+
+async def gather_reads(session, *reads):
+    """asyncio.gather, except that reads sharing a session run one at a time."""
+    if session is None:
+        return await asyncio.gather(*reads)
+    return [await read for read in reads]
+
+# ===== ADMIN SEARCH =====
+# Every filter maps onto an index created in ensure_indexes(); benchmarks.py
+# explain-filters checks that no combination falls back to a collection scan.
+def prefix_regex(value: str) -> dict:
+    # An anchored, case-sensitive prefix regex is answered from index bounds
+    return {"$regex": "^" + re.escape(value)}
+
+def build_user_filter(q: Optional[str] = None, role: Optional[str] = None, is_blocked: Optional[bool] = None) -> dict:
+    query = {}
+    if q:
+        query["email_key"] = prefix_regex(q.strip().lower())
+    if role:
+        query["role"] = role
+    if is_blocked is not None:
+        query["is_blocked"] = is_blocked
+    return query
+
+# A query made only of phone punctuation and at least one digit, e.g. "+380 (67) 123-45"
+PHONE_QUERY_RE = re.compile(r"[\d\s+\-()]*\d[\d\s+\-()]*")
+
+def build_trader_filter(q: Optional[str] = None) -> dict:
+    if not q:
+        return {}
+    clauses = [{"nickname_key": prefix_regex(q.strip().lower())}]
+    # Only phone-shaped queries search phones, so "trader2" is not a search for phones starting with 2
+    if PHONE_QUERY_RE.fullmatch(q.strip()):
+        clauses.append({"phone_key": prefix_regex(phone_digits(q))})
+    return {"$or": clauses} if len(clauses) > 1 else clauses[0]
+
+def build_transaction_filter(
+    status_filter: Optional[str] = None,
+    trader_id: Optional[str] = None,
+    currency: Optional[str] = None,
+    amount_min: Optional[float] = None,
+    amount_max: Optional[float] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+) -> dict:
+    query = {}
+    if status_filter:
+        query["status"] = status_filter
+    if trader_id:
+        query["trader_id"] = trader_id
+    if currency:
+        query["currency"] = currency
+    if amount_min is not None or amount_max is not None:
+        query["amount"] = {
+            **({"$gte": amount_min} if amount_min is not None else {}),
+            **({"$lte": amount_max} if amount_max is not None else {})
+        }
+    if date_from is not None or date_to is not None:
+        query.update(date_range("created_at", date_from, date_to))
+    return query
+
+async def count_matching(collection, query: dict, session=None) -> int:
+    # estimated_document_count takes no session, so causal reads count exactly
+    if not query and session is None:
+        return await collection.estimated_document_count()
+    return await collection.count_documents(query, session=session)
+
+async def backfill_search_keys():
+    """Derive the normalised search keys for documents written before they existed."""
+    await db.users.update_many(
+        {"email_key": None},
+        [{"$set": {"email_key": {"$toLower": "$email"}}}]
+    )
+    await db.traders.update_many(
+        {"$or": [{"nickname_key": None}, {"phone_key": None}]},
+        [{"$set": {
+            "nickname_key": {"$toLower": "$nickname"},
+            "phone_key": {"$reduce": {
+                "input": {"$regexFindAll": {"input": "$phone", "regex": "[0-9]"}},
+                "initialValue": "",
+                "in": {"$concat": ["$$value", "$$this.match"]}
+            }}
+        }}]
+    )
+
 # ===== ADMIN ROUTES =====
 @api_router.get("/admin/traders")
-async def get_all_traders(user: dict = Depends(require_admin)):
-    traders = await db.traders.find({}, {"_id": 0}).to_list(1000)
+async def get_all_traders(
+    response: Response,
+    q: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=1000),
+    user: dict = Depends(require_admin),
+    session=Depends(reporting_session)
+):
+    query = build_trader_filter(q)
+    traders, total = await gather_reads(
+        session,
+        reporting_db.traders.find(query, {"_id": 0}, session=session).sort("created_at", -1).skip(skip).limit(limit).to_list(limit),
+        count_matching(reporting_db.traders, query, session)
+    )
+    response.headers["X-Total-Count"] = str(total)
     
     # Enrich with user email
+    user_ids = [trader['user_id'] for trader in traders]
+    user_docs = await reporting_db.users.find(
+        {"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "email": 1}, session=session
+    ).to_list(None) if user_ids else []
+    emails = {doc['id']: doc['email'] for doc in user_docs}
     for trader in traders:
-        user_doc = await db.users.find_one({"id": trader['user_id']}, {"_id": 0})
-        trader['email'] = user_doc['email'] if user_doc else None
+        trader['email'] = emails.get(trader['user_id'])
     
     return traders
 
 @api_router.get("/admin/users")
-async def get_all_users(user: dict = Depends(require_admin)):
-    users = await db.users.find({}, {"_id": 0, "password_hash": 0}).to_list(1000)
+async def get_all_users(
+    response: Response,
+    q: Optional[str] = None,
+    role: Optional[str] = None,
+    is_blocked: Optional[bool] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=1000),
+    fields: Optional[str] = None,
+    user: dict = Depends(require_admin),
+    session=Depends(reporting_session)
+):
+    query = build_user_filter(q, role, is_blocked)
+    projection = sparse_projection(fields, USER_FIELDS) or {"_id": 0, "password_hash": 0}
+    users, total = await gather_reads(
+        session,
+        reporting_db.users.find(query, projection, session=session).sort("created_at", -1).skip(skip).limit(limit).to_list(limit),
+        count_matching(reporting_db.users, query, session)
+    )
+    response.headers["X-Total-Count"] = str(total)
     return users
 
 class UserCreate(BaseModel):
@@ -465,7 +1856,7 @@ class UserCreate(BaseModel):
     role: str = "user"  # user, trader, admin
 
 @api_router.post("/admin/users/create")
-async def admin_create_user(data: UserCreate, admin: dict = Depends(require_admin)):
+async def admin_create_user(data: UserCreate, response: Response, admin: dict = Depends(require_admin)):
     # Check if user already exists
     existing = await db.users.find_one({"email": data.email}, {"_id": 0})
     if existing:
@@ -481,7 +1872,8 @@ async def admin_create_user(data: UserCreate, admin: dict = Depends(require_admi
         password_hash=hash_password(data.password),
         role=data.role
     )
-    await db.users.insert_one(new_user.model_dump())
+    async with causal_write(response) as session:
+        await db.users.insert_one(new_user.model_dump(), session=session)
     
     return {
         "message": "User created successfully",
@@ -494,7 +1886,7 @@ async def admin_create_user(data: UserCreate, admin: dict = Depends(require_admi
     }
 
 @api_router.put("/admin/users/{user_id}/block")
-async def admin_block_user(user_id: str, admin: dict = Depends(require_admin)):
+async def admin_block_user(user_id: str, response: Response, admin: dict = Depends(require_admin)):
     user = await db.users.find_one({"id": user_id}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
@@ -502,35 +1894,71 @@ async def admin_block_user(user_id: str, admin: dict = Depends(require_admin)):
     # Toggle is_blocked field
     current_blocked = user.get('is_blocked', False)
     new_status = not current_blocked
-    await db.users.update_one({"id": user_id}, {"$set": {"is_blocked": new_status}})
+    async with causal_write(response) as session:
+        await db.users.update_one({"id": user_id}, {"$set": {"is_blocked": new_status}}, session=session)
+    await bump_token_epoch(user_id)
     
     return {"message": "User status updated", "is_blocked": new_status}
 
 @api_router.post("/admin/traders/{trader_id}/add-balance")
-async def admin_add_balance(trader_id: str, data: AdminAddBalance, user: dict = Depends(require_admin)):
-    trader = await db.traders.find_one({"id": trader_id}, {"_id": 0})
+async def admin_add_balance(trader_id: str, data: AdminAddBalance, response: Response, user: dict = Depends(require_admin)):
+    async with causal_write(response) as session:
+        trader = await db.traders.find_one_and_update(
+            {"id": trader_id},
+            {"$inc": {"usdt_balance": data.amount}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
     if not trader:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trader not found")
     
-    new_balance = trader['usdt_balance'] + data.amount
-    await db.traders.update_one({"id": trader_id}, {"$set": {"usdt_balance": new_balance}})
-    
-    return {"message": "Balance added", "new_balance": new_balance}
+    return {"message": "Balance added", "new_balance": trader['usdt_balance']}
 
 @api_router.put("/admin/traders/{trader_id}/block")
-async def admin_block_trader(trader_id: str, user: dict = Depends(require_admin)):
+async def admin_block_trader(trader_id: str, response: Response, user: dict = Depends(require_admin)):
     trader = await db.traders.find_one({"id": trader_id}, {"_id": 0})
     if not trader:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trader not found")
     
     new_status = not trader['is_blocked']
-    await db.traders.update_one({"id": trader_id}, {"$set": {"is_blocked": new_status}})
+    async with causal_write(response) as session:
+        await db.traders.update_one({"id": trader_id}, {"$set": {"is_blocked": new_status}}, session=session)
     
     return {"message": "Trader status updated", "is_blocked": new_status}
 
 @api_router.get("/admin/transactions")
-async def get_all_transactions(user: dict = Depends(require_admin)):
-    transactions = await db.transactions.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+async def get_all_transactions(
+    response: Response,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    trader_id: Optional[str] = None,
+    currency: Optional[str] = None,
+    amount_min: Optional[float] = None,
+    amount_max: Optional[float] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    include_archived: bool = False,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=1000),
+    fields: Optional[str] = None,
+    user: dict = Depends(require_admin),
+    session=Depends(reporting_session)
+):
+    query = build_transaction_filter(status_filter, trader_id, currency, amount_min, amount_max, date_from, date_to)
+    projection = sparse_projection(fields, TRANSACTION_FIELDS)
+    if include_archived:
+        transactions, total = await gather_reads(
+            session,
+            find_transactions(query, limit=limit, include_archived=True, skip=skip, source=reporting_db, session=session, projection=projection),
+            count_transactions(query, reporting_db, session)
+        )
+    else:
+        transactions, total = await gather_reads(
+            session,
+            find_transactions(query, limit=limit, skip=skip, source=reporting_db, session=session, projection=projection),
+            count_matching(reporting_db.transactions, query, session)
+        )
+    response.headers["X-Total-Count"] = str(total)
     return transactions
 
 @api_router.get("/admin/settings")
@@ -542,13 +1970,14 @@ async def get_settings(user: dict = Depends(require_admin)):
             "usd_to_uah_rate": 41.5,
             "deposit_wallet_address": "TB4K5h9QwFGSYR2LLJS9ejmt9EjHWurvi1"
         }
-        await db.settings.insert_one(settings)
+        await db.settings.insert_one(dict(settings))
+        invalidate_settings_cache()
     return settings
 
 @api_router.get("/settings/public")
 async def get_public_settings():
     """Public endpoint for deposit wallet address"""
-    settings = await db.settings.find_one({}, {"_id": 0})
+    settings = await load_settings()
     if not settings:
         return {"deposit_wallet_address": "TB4K5h9QwFGSYR2LLJS9ejmt9EjHWurvi1"}
     return {"deposit_wallet_address": settings.get("deposit_wallet_address", "TB4K5h9QwFGSYR2LLJS9ejmt9EjHWurvi1")}
@@ -556,15 +1985,16 @@ async def get_public_settings():
 @api_router.put("/admin/settings")
 async def update_settings(data: AdminSettings, user: dict = Depends(require_admin)):
     await db.settings.update_one({}, {"$set": data.model_dump()}, upsert=True)
+    invalidate_settings_cache()
     return {"message": "Settings updated"}
 
 # ===== STATS ROUTE =====
 @api_router.get("/stats")
-async def get_stats(user: dict = Depends(get_current_user)):
+async def get_stats(user: dict = Depends(get_current_user), session=Depends(reporting_session)):
     if user['role'] == 'trader':
-        trader = await db.traders.find_one({"user_id": user['id']}, {"_id": 0})
+        trader = await get_trader_for_user(user['id'])
         if trader:
-            completed = await db.transactions.count_documents({"trader_id": trader['id'], "status": "completed"})
+            completed = await count_transactions({"trader_id": trader['id'], "status": "completed"})
             pending = await db.transactions.count_documents({"trader_id": trader['id'], "status": "user_confirmed"})
             cards_count = await db.cards.count_documents({"trader_id": trader['id']})
             return {
@@ -574,10 +2004,15 @@ async def get_stats(user: dict = Depends(get_current_user)):
                 "cards_count": cards_count
             }
     elif user['role'] == 'admin':
-        total_traders = await db.traders.count_documents({})
-        total_users = await db.users.count_documents({"role": "user"})
-        total_transactions = await db.transactions.count_documents({})
-        completed_transactions = await db.transactions.count_documents({"status": "completed"})
+        # Totals for the admin dashboard are reporting reads; traders and users
+        # above see their own balances and queues from the primary
+        total_traders = await count_matching(reporting_db.traders, {}, session)
+        total_users = await reporting_db.users.count_documents({"role": "user"}, session=session)
+        total_transactions = (
+            await count_matching(reporting_db.transactions, {}, session)
+            + await count_matching(reporting_db.transactions_archive, {}, session)
+        )
+        completed_transactions = await count_transactions({"status": "completed"}, reporting_db, session)
         return {
             "total_traders": total_traders,
             "total_users": total_users,
@@ -585,21 +2020,258 @@ async def get_stats(user: dict = Depends(get_current_user)):
             "completed_transactions": completed_transactions
         }
     else:
-        completed = await db.transactions.count_documents({"user_id": user['id'], "status": "completed"})
+        completed = await count_transactions({"user_id": user['id'], "status": "completed"})
         pending = await db.transactions.count_documents({"user_id": user['id'], "status": {"$in": ["pending", "user_confirmed"]}})
         return {
             "completed_transactions": completed,
             "pending_transactions": pending
         }
 
+# ===== METRICS ROUTES =====
+@api_router.get("/admin/metrics/db")
+async def get_db_metrics(reset: bool = False, user: dict = Depends(require_admin)):
+    routes = {
+        route: {
+            **stats,
+            "db_ms": round(stats["db_ms"], 2),
+            "avg_queries": round(stats["queries"] / stats["requests"], 2),
+            "avg_db_ms": round(stats["db_ms"] / stats["requests"], 2)
+        }
+        for route, stats in route_db_stats.items()
+    }
+    if reset:
+        route_db_stats.clear()
+    return {"profiler_enabled": DB_PROFILER_ENABLED, "routes": routes}
+
+@api_router.get("/admin/metrics/card-queue")
+async def get_card_queue_metrics(user: dict = Depends(require_admin)):
+    return {"queue": card_queue.snapshot(), "allocation": allocation_stats}
+
+# ===== HEALTH ROUTES =====
+FAST_REQUEST_MS = float(os.environ.get('FAST_REQUEST_MS', '50'))
+HEALTH_PING_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_PING_TIMEOUT_SECONDS', '1'))
+
+startup_state = {
+    "ready": False,
+    "startup_ms": None,
+    "warmup_attempts": 0,
+    "warmup_connections": 0,
+    "warmup_active_cards": 0,
+    "first_request_ms": None,
+    "first_fast_request_ms": None,
+}
+
+def pool_stats() -> dict:
+    stats = pool_monitor.snapshot()
+    stats["max_pool_size"] = MONGO_MAX_POOL_SIZE
+    stats["min_pool_size"] = MONGO_MIN_POOL_SIZE
+    stats["saturation"] = round(stats["checked_out"] / MONGO_MAX_POOL_SIZE, 3) if MONGO_MAX_POOL_SIZE else 0.0
+    return stats
+
+@api_router.get("/health")
+@api_router.get("/health/live")
+async def health_live():
+    """Liveness: the process and event loop are responsive. Never touches MongoDB."""
+    return {
+        "status": "alive",
+        "uptime_seconds": round(time.monotonic() - PROCESS_STARTED_AT, 1)
+    }
+
+@api_router.get("/health/ready")
+async def health_ready():
+    """Readiness: warm-up finished and MongoDB answers a ping within the timeout; pool use is informational."""
+    db_ok = True
+    ping_ms = None
+    try:
+        started = time.perf_counter()
+        await asyncio.wait_for(client.admin.command('ping'), timeout=HEALTH_PING_TIMEOUT_SECONDS)
+        ping_ms = round((time.perf_counter() - started) * 1000, 2)
+    except Exception as e:
+        logger.warning(f"Readiness ping failed: {e}")
+        db_ok = False
+
+    # Saturation is reported but not acted on: a load spike saturates every
+    # replica at once, and failing readiness on it would drop them all together
+    pool = pool_stats()
+    pool["saturated"] = pool["saturation"] >= 1.0
+    ready = startup_state["ready"] and db_ok
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "database": {"ok": db_ok, "ping_ms": ping_ms},
+        "pool": pool,
+        "startup": dict(startup_state),
+    }
+    if not ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=body)
+    return body
+
 app.include_router(api_router)
 
+@app.middleware("http")
+async def profile_db_queries(request: Request, call_next):
+    if not DB_PROFILER_ENABLED:
+        return await call_next(request)
+
+    profile = RequestProfile()
+    token = current_profile.set(profile)
+    try:
+        response = await call_next(request)
+    finally:
+        current_profile.reset(token)
+
+    route = request.scope.get("route")
+    # Raw paths and methods are client-chosen; pooling them keeps route_db_stats bounded
+    if route is not None and request.method in getattr(route, "methods", ()):
+        route_key = f"{request.method} {route.path}"
+    else:
+        route_key = "<unmatched>"
+    record_route_profile(route_key, profile)
+
+    if profile.query_count >= SLOW_REQUEST_QUERY_COUNT or profile.db_ms >= SLOW_REQUEST_DB_MS:
+        slowest = ", ".join(f"{name} {coll or ''} {ms:.1f}ms" for ms, name, coll in profile.slowest())
+        logger.warning(
+            f"Slow request {route_key}: {profile.query_count} queries, "
+            f"{profile.db_ms:.1f}ms in MongoDB; slowest: {slowest}"
+        )
+    else:
+        for ms, name, coll in profile.slowest(1):
+            if ms >= SLOW_COMMAND_MS:
+                logger.warning(f"Slow command in {route_key}: {name} {coll or ''} {ms:.1f}ms")
+
+    if DB_PROFILER_SERVER_TIMING:
+        response.headers["Server-Timing"] = f'db;dur={profile.db_ms:.2f};desc="{profile.query_count} queries"'
+    return response
+
+@app.middleware("http")
+async def record_cold_start(request: Request, call_next):
+    if startup_state["first_fast_request_ms"] is not None:
+        return await call_next(request)
+
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    since_start_ms = round((time.monotonic() - PROCESS_STARTED_AT) * 1000, 1)
+    if request.url.path.startswith("/api/") and not request.url.path.startswith("/api/health"):
+        if startup_state["first_request_ms"] is None:
+            startup_state["first_request_ms"] = since_start_ms
+        if elapsed_ms <= FAST_REQUEST_MS:
+            startup_state["first_fast_request_ms"] = since_start_ms
+            logger.info(f"Cold start: first fast request served {since_start_ms}ms after process start")
+    return response
+
+# ===== COMPRESSION =====
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '5'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4'))
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """br or gzip, whichever the client accepts (br first when installed); None for identity."""
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+    for encoding in ("br", "gzip") if brotli else ("gzip",):
+        if weights.get(encoding, weights.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+def stream_compressor(encoding: str):
+    """(compress, finish) callables producing one `encoding` stream."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    # wbits 31 selects the gzip container
+    compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+class CompressionMiddleware:
+    """Compresses responses of at least COMPRESSION_MIN_BYTES with the negotiated encoding.
+
+    The body is buffered until it reaches the threshold or ends, so small
+    responses go out as they are; larger ones are compressed as they stream.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        response_start = None
+        buffered = []
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal response_start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                response_start = message
+                passthrough = "content-encoding" in Headers(raw=message["headers"])
+                if passthrough:
+                    await send(message)
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            more_body = message.get("more_body", False)
+            if compressor is not None:
+                body = compressor[0](message.get("body", b""))
+                if not more_body:
+                    body += compressor[1]()
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            buffered.append(message.get("body", b""))
+            size = sum(len(chunk) for chunk in buffered)
+            if more_body and size < self.minimum_size:
+                return
+            headers = MutableHeaders(raw=response_start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            body = b"".join(buffered)
+            buffered.clear()
+            if size < self.minimum_size:
+                passthrough = True
+                await send(response_start)
+                await send({"type": "http.response.body", "body": body})
+                return
+            compressor = stream_compressor(encoding)
+            body = compressor[0](body)
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                body += compressor[1]()
+                headers["Content-Length"] = str(len(body))
+            headers["Content-Encoding"] = encoding
+            await send(response_start)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Operation-Time"],
 )
 
 logging.basicConfig(
@@ -608,6 +2280,107 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+async def ensure_indexes():
+    await asyncio.gather(
+        db.users.create_index("id", unique=True),
+        db.users.create_index("email"),
+        db.users.create_index("email_key"),
+        db.users.create_index([("role", 1), ("created_at", -1)]),
+        db.users.create_index([("is_blocked", 1), ("created_at", -1)]),
+        db.users.create_index([("created_at", -1)]),
+        db.users.create_index("token_epoch_at", sparse=True),
+        db.traders.create_index("id", unique=True),
+        db.traders.create_index("user_id", unique=True),
+        db.traders.create_index("nickname_key"),
+        db.traders.create_index("phone_key"),
+        db.traders.create_index([("created_at", -1)]),
+        db.cards.create_index("id", unique=True),
+        db.cards.create_index([("status", 1), ("currency", 1)]),
+        db.cards.create_index("trader_id"),
+        db.cards.create_index([("limit_period", 1), ("window_start", 1)]),
+        db.transactions.create_index("id", unique=True),
+        db.transactions.create_index([("user_id", 1), ("created_at", -1)]),
+        db.transactions.create_index([("trader_id", 1), ("created_at", -1)]),
+        db.transactions.create_index([("status", 1), ("created_at", -1)]),
+        db.transactions.create_index([("status", 1), ("expires_at", 1)]),
+        db.transactions.create_index([("trader_id", 1), ("status", 1), ("created_at", -1)]),
+        db.transactions.create_index([("currency", 1), ("created_at", -1)]),
+        db.transactions.create_index([("amount", 1), ("created_at", -1)]),
+        db.transactions.create_index([("created_at", -1)]),
+        db.transactions_archive.create_index("id", unique=True),
+        db.transactions_archive.create_index([("user_id", 1), ("created_at", -1)]),
+        db.transactions_archive.create_index([("trader_id", 1), ("created_at", -1)]),
+        db.transactions_archive.create_index([("status", 1), ("created_at", -1)]),
+        db.transactions_archive.create_index([("created_at", -1)]),
+        db.outbox.create_index("id", unique=True),
+        db.outbox.create_index([("status", 1), ("next_attempt_at", 1)]),
+        db.outbox.create_index("delivered_at", expireAfterSeconds=OUTBOX_RETENTION_DAYS * 86400),
+        db.audit_log.create_index("event_id", unique=True),
+        db.notifications.create_index("event_id", unique=True),
+        db.notifications.create_index([("trader_id", 1), ("created_at", -1)]),
+    )
+
+async def warm_up_pool():
+    """Open connections up front so the first requests after a deploy skip connect and TLS."""
+    results = await asyncio.gather(
+        *[client.admin.command('ping') for _ in range(max(1, MONGO_WARMUP_CONNECTIONS))],
+        return_exceptions=True
+    )
+    return sum(1 for r in results if not isinstance(r, Exception))
+
+async def warm_up() -> bool:
+    """One warm-up attempt; readiness reports not_ready until an attempt succeeds."""
+    started = time.perf_counter()
+    startup_state["warmup_attempts"] += 1
+    try:
+        startup_state["warmup_connections"] = await warm_up_pool()
+        hello = await client.admin.command('hello')
+        mongo_topology["transactions"] = 'setName' in hello or hello.get('msg') == 'isdbgrid'
+        mongo_topology["sessions"] = mongo_topology["transactions"]
+        await ensure_indexes()
+        await backfill_search_keys()
+        await backfill_token_epoch_times()
+        await load_settings()
+        await refresh_token_epochs()
+        # Card reads are never cached in-process; run the allocation read once per
+        # currency so its index and documents are in the server cache for the first requests
+        warmed_cards = 0
+        for currency in await db.cards.distinct("currency", {"status": "active"}):
+            warmed_cards += len(await active_cards(currency))
+        startup_state["warmup_active_cards"] = warmed_cards
+        startup_state["ready"] = True
+    except Exception as e:
+        logger.error(f"Startup warm-up attempt {startup_state['warmup_attempts']} failed: {e}")
+        return False
+    startup_state["startup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(
+        f"Warm-up finished in {startup_state['startup_ms']}ms: "
+        f"{startup_state['warmup_connections']} connections, "
+        f"{startup_state['warmup_active_cards']} active cards"
+    )
+    return True
+
+async def warm_up_until_ready():
+    delay = WARMUP_RETRY_SECONDS
+    while True:
+        await asyncio.sleep(delay)
+        if await warm_up():
+            return
+        delay = min(delay * 2, WARMUP_RETRY_MAX_SECONDS)
+
+async def token_epoch_refresher():
+    while True:
+        await asyncio.sleep(TOKEN_EPOCH_REFRESH_SECONDS)
+        try:
+            await refresh_token_epochs()
+        except Exception as e:
+            logger.warning(f"Token epoch refresh failed: {e}")
+
+background_tasks: List[asyncio.Task] = []
+
+def start_background_tasks():
+    background_tasks.append(asyncio.create_task(token_epoch_refresher()))
+    background_tasks.append(asyncio.create_task(outbox_consumer()))
+    background_tasks.append(asyncio.create_task(expiry_sweeper()))
+    background_tasks.append(asyncio.create_task(transaction_archiver()))
+    background_tasks.append(asyncio.create_task(card_limit_roller()))
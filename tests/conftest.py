@@ -0,0 +1,214 @@
+"""In-process test harness.
+
+The FastAPI app runs through httpx's ASGI transport against an isolated
+database per test: mongomock-motor by default, or a real MongoDB when
+TEST_MONGO_URL is set (one scratch database per xdist worker and test).
+"""
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import bcrypt
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "skypall_test")
+# Fail fast instead of queueing; tests that exercise the queue raise it explicitly
+os.environ.setdefault("CARD_QUEUE_TIMEOUT_SECONDS", "0")
+
+import server  # noqa: E402
+
+TEST_MONGO_URL = os.environ.get("TEST_MONGO_URL")
+# An existing replica set for the read-routing tests; otherwise one is started when mongod is on PATH
+TEST_REPLICA_SET_URL = os.environ.get("TEST_REPLICA_SET_URL")
+# Scale the latency budgets on slow CI machines, e.g. PERF_BUDGET_SCALE=3
+PERF_BUDGET_SCALE = float(os.environ.get("PERF_BUDGET_SCALE", "1"))
+# Hashes made at the minimum bcrypt cost keep logins cheap in tests
+_hash_cache: dict = {}
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def fast_hash(password: str) -> str:
+    if password not in _hash_cache:
+        _hash_cache[password] = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=4)).decode("utf-8")
+    return _hash_cache[password]
+
+
+@pytest.fixture
+async def database(monkeypatch):
+    worker = os.environ.get("PYTEST_XDIST_WORKER", "main")
+    name = f"skypall_test_{worker}_{uuid.uuid4().hex[:8]}"
+    if TEST_MONGO_URL:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        mongo = AsyncIOMotorClient(TEST_MONGO_URL, tz_aware=True)
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        mongo = AsyncMongoMockClient(tz_aware=True)
+    db = mongo[name]
+
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "reporting_db", db)
+    monkeypatch.setattr(server, "hash_password", fast_hash)
+    monkeypatch.setitem(server.mongo_topology, "transactions", False)
+    monkeypatch.setitem(server.mongo_topology, "sessions", False)
+    monkeypatch.setitem(server._token_epochs_state, "loaded", True)
+    monkeypatch.setattr(server, "card_queue", server.CardMatchingQueue())
+    server.invalidate_settings_cache()
+    for cache in (server._verified_tokens, server.token_epochs, server._token_epoch_bumped_at, server._archived_counts):
+        cache.clear()
+
+    await server.ensure_indexes()
+    yield db
+    if TEST_MONGO_URL:
+        await mongo.drop_database(name)
+        mongo.close()
+
+
+@pytest.fixture
+async def client(database):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as http:
+        yield http
+
+
+async def create_user(db, email: str, password: str = "secret123", role: str = "user", **fields) -> dict:
+    user = server.User(email=email, password_hash=fast_hash(password), role=role, **fields)
+    await db.users.insert_one(user.model_dump())
+    return user.model_dump()
+
+
+def fail_outbox_writes(database, monkeypatch):
+    """Make every outbox insert raise, as when MongoDB drops mid-request."""
+    collection_type = type(database.outbox)
+    insert_many = collection_type.insert_many
+
+    async def failing_insert_many(self, documents, *args, **kwargs):
+        if self.name == "outbox":
+            raise ConnectionError("outbox unavailable")
+        return await insert_many(self, documents, *args, **kwargs)
+
+    monkeypatch.setattr(collection_type, "insert_many", failing_insert_many)
+
+
+async def login(client, email: str, password: str = "secret123") -> dict:
+    response = await client.post("/api/auth/login", json={"email": email, "password": password})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+
+@pytest.fixture
+async def admin_headers(client, database):
+    await create_user(database, "admin@test.com", role="admin")
+    return await login(client, "admin@test.com")
+
+
+@pytest.fixture
+async def user_headers(client, database):
+    await create_user(database, "user@test.com")
+    return await login(client, "user@test.com")
+
+
+@pytest.fixture
+async def trader(client, database):
+    """A trader with 1000 USDT and one active 100 000 UAH card."""
+    user = await create_user(database, "trader@test.com", role="trader")
+    profile = server.Trader(
+        user_id=user["id"], name="Test Trader", nickname="Tester",
+        usdt_address="TTestAddress", phone="+380 67 123 45 67", usdt_balance=1000.0
+    )
+    await database.traders.insert_one(profile.model_dump())
+    headers = await login(client, "trader@test.com")
+    response = await client.post("/api/trader/cards", headers=headers, json={
+        "card_number": "4149000011112222", "bank_name": "Mono",
+        "holder_name": "TEST TRADER", "limit": 100000, "currency": "UAH"
+    })
+    assert response.status_code == 200, response.text
+    return {"headers": headers, "profile": profile.model_dump(), "card": response.json()}
+
+
+@pytest.fixture
+def within_budget():
+    """`with within_budget(50): ...` fails the test if the block takes longer than 50 ms."""
+    @contextmanager
+    def check(budget_ms: float):
+        started = time.perf_counter()
+        yield
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        assert elapsed_ms <= budget_ms * PERF_BUDGET_SCALE, f"took {elapsed_ms:.1f}ms, budget {budget_ms}ms"
+    return check
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_replica_set(seed, members: int, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            states = [m["stateStr"] for m in seed.admin.command("replSetGetStatus")["members"]]
+        except Exception:
+            states = []
+        if states.count("PRIMARY") == 1 and states.count("SECONDARY") == members - 1:
+            return
+        time.sleep(0.5)
+    raise RuntimeError(f"replica set did not come up within {timeout}s")
+
+
+@pytest.fixture(scope="session")
+def replica_set(tmp_path_factory):
+    """Connection URL of a three-node replica set on localhost.
+
+    Uses TEST_REPLICA_SET_URL when set; otherwise starts three mongod
+    processes for the session and skips when mongod is not installed.
+    """
+    if TEST_REPLICA_SET_URL:
+        yield TEST_REPLICA_SET_URL
+        return
+    mongod = shutil.which("mongod")
+    if not mongod:
+        pytest.skip("mongod not on PATH and TEST_REPLICA_SET_URL not set")
+
+    from pymongo import MongoClient
+
+    ports = [_free_port() for _ in range(3)]
+    processes = []
+    try:
+        for port in ports:
+            path = tmp_path_factory.mktemp(f"mongod-{port}")
+            processes.append(subprocess.Popen(
+                [mongod, "--replSet", "skypall", "--port", str(port), "--bind_ip", "127.0.0.1",
+                 "--dbpath", str(path), "--logpath", str(path / "mongod.log")],
+                stdout=subprocess.DEVNULL
+            ))
+        seed = MongoClient(f"mongodb://127.0.0.1:{ports[0]}", directConnection=True, serverSelectionTimeoutMS=30000)
+        seed.admin.command("replSetInitiate", {
+            "_id": "skypall",
+            "members": [
+                # The first node is preferred as primary so the set settles quickly
+                {"_id": i, "host": f"127.0.0.1:{port}", "priority": 2 if i == 0 else 1}
+                for i, port in enumerate(ports)
+            ]
+        })
+        _wait_for_replica_set(seed, len(ports))
+        seed.close()
+        yield f"mongodb://{','.join(f'127.0.0.1:{port}' for port in ports)}/?replicaSet=skypall"
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
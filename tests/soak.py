@@ -0,0 +1,344 @@
+"""Long-running soak test against the in-process app.
+
+Drives a mixed user, trader and admin workload shaped like the dashboards
+(each polls its endpoints every --poll-interval seconds, users request and
+confirm payments, traders confirm them) and samples process health at
+intervals: RSS, top tracemalloc allocators, asyncio task count, event-loop
+lag and request latency. The run fails when RSS, p99 latency or the task
+count trends upward beyond the configured thresholds.
+
+    python -m tests.soak --duration 14400 --report soak.jsonl
+
+Uses mongomock-motor unless TEST_MONGO_URL points at a real server. With
+the in-memory database, settled data is purged after every sample so
+memory growth reflects the application and not the stored documents.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+import httpx
+
+from .conftest import TEST_MONGO_URL, create_user, fast_hash, login  # noqa: F401  (conftest sets up sys.path and env)
+
+import server  # noqa: E402
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # Peak rather than current RSS, but still monotonic evidence of growth
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def linear_slope(xs, ys) -> float:
+    mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+    denominator = sum((x - mean_x) ** 2 for x in xs)
+    if not denominator:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / denominator
+
+
+def evaluate(samples, rss_slope_limit=10.0, p99_growth_limit=0.5, task_growth_limit=50, warmup_fraction=0.1):
+    """Failure reasons for a finished run; empty when healthy.
+
+    The first `warmup_fraction` of samples is ignored while caches and pools fill.
+    RSS is judged by its least-squares slope in MB/hour, p99 latency and the
+    task count by comparing the last third of the run with the first third.
+    """
+    steady = samples[int(len(samples) * warmup_fraction):]
+    if len(steady) < 6:
+        return []
+    reasons = []
+
+    slope = linear_slope([s["elapsed_s"] / 3600 for s in steady], [s["rss_mb"] for s in steady])
+    if slope > rss_slope_limit:
+        reasons.append(f"RSS grows {slope:.1f} MB/hour (limit {rss_slope_limit})")
+
+    third = len(steady) // 3
+    head, tail = steady[:third], steady[-third:]
+    p99_head = statistics.fmean(s["p99_ms"] for s in head)
+    p99_tail = statistics.fmean(s["p99_ms"] for s in tail)
+    if p99_head and p99_tail / p99_head - 1 > p99_growth_limit:
+        reasons.append(f"p99 latency grew from {p99_head:.1f}ms to {p99_tail:.1f}ms")
+
+    tasks_head = statistics.fmean(s["tasks"] for s in head)
+    tasks_tail = statistics.fmean(s["tasks"] for s in tail)
+    if tasks_tail - tasks_head > task_growth_limit:
+        reasons.append(f"asyncio tasks grew from {tasks_head:.0f} to {tasks_tail:.0f}")
+    return reasons
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.requests = 0
+        self.client_errors = 0
+        self.server_errors = 0
+
+    async def call(self, http, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await http.request(method, url, **kwargs)
+        except Exception:
+            self.server_errors += 1
+            return None
+        self.latencies.append((time.perf_counter() - started) * 1000)
+        self.requests += 1
+        if response.status_code >= 500:
+            self.server_errors += 1
+        elif response.status_code >= 400:
+            # Races between the simulated user and trader are expected to lose sometimes
+            self.client_errors += 1
+        return response
+
+    def drain_window(self):
+        window, self.latencies = self.latencies, []
+        return window
+
+
+async def _pause(stop, seconds):
+    """Sleep for `seconds` or until the run stops; True once it has."""
+    try:
+        async with asyncio.timeout(seconds):
+            await stop.wait()
+    except TimeoutError:
+        pass
+    return stop.is_set()
+
+
+async def _measure_loop_lag(interval, state):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag_ms = (time.perf_counter() - started - interval) * 1000
+        state["max_lag_ms"] = max(state["max_lag_ms"], lag_ms)
+
+
+async def _poll(http, recorder, headers, paths):
+    for path in paths:
+        await recorder.call(http, "GET", path, headers=headers)
+
+
+# Sessions stop on the `stop` event rather than on cancel(): ASGITransport runs
+# the app inside the session task, and the anyio task groups of Starlette's
+# middleware can absorb a cancel() that lands mid-request.
+
+async def _user_session(http, recorder, headers, args, rng, stop):
+    if await _pause(stop, rng.uniform(0, args.poll_interval)):
+        return
+    while True:
+        await _poll(http, recorder, headers, ("/api/stats", "/api/user/transactions"))
+        if rng.random() < args.request_probability:
+            response = await recorder.call(http, "POST", "/api/user/request-card", headers=headers,
+                                           json={"amount": rng.randint(1, 50), "currency": "UAH"})
+            if response is not None and response.status_code == 200:
+                txn_id = response.json()["transaction_id"]
+                await recorder.call(http, "POST", f"/api/user/confirm-payment/{txn_id}", headers=headers)
+        if await _pause(stop, args.poll_interval * rng.uniform(0.8, 1.2)):
+            return
+
+
+async def _trader_session(http, recorder, headers, args, rng, stop):
+    if await _pause(stop, rng.uniform(0, args.poll_interval)):
+        return
+    while True:
+        await _poll(http, recorder, headers, (
+            "/api/trader/profile", "/api/trader/cards", "/api/stats",
+            "/api/settings/public", "/api/trader/notifications"
+        ))
+        response = await recorder.call(http, "GET", "/api/trader/transactions", headers=headers)
+        if response is not None and response.status_code == 200:
+            for txn in response.json():
+                if txn["status"] == "user_confirmed":
+                    await recorder.call(http, "POST", f"/api/trader/confirm-payment/{txn['id']}", headers=headers)
+        if await _pause(stop, args.poll_interval * rng.uniform(0.8, 1.2)):
+            return
+
+
+async def _admin_session(http, recorder, headers, args, rng, stop):
+    while True:
+        await _poll(http, recorder, headers, (
+            "/api/admin/traders", "/api/admin/users", "/api/admin/transactions",
+            "/api/stats", "/api/admin/settings"
+        ))
+        if await _pause(stop, args.poll_interval * 2):
+            return
+
+
+async def _purge_settled(db):
+    await db.transactions.delete_many({"status": {"$in": ["completed", "cancelled"]}})
+    await db.outbox.delete_many({"status": "delivered"})
+    await db.audit_log.delete_many({})
+    await db.notifications.delete_many({})
+
+
+async def _seed(db, http, args):
+    headers = {"users": [], "traders": []}
+    await create_user(db, "soak-admin@test.com", role="admin")
+    headers["admin"] = await login(http, "soak-admin@test.com")
+    for i in range(args.traders):
+        user = await create_user(db, f"soak-trader{i}@test.com", role="trader")
+        trader = server.Trader(user_id=user["id"], name=f"Soak {i}", nickname=f"soak{i}",
+                               usdt_address="TSoak", phone="+380000000000", usdt_balance=1e12)
+        await db.traders.insert_one(trader.model_dump())
+        trader_headers = await login(http, f"soak-trader{i}@test.com")
+        await http.post("/api/trader/cards", headers=trader_headers, json={
+            "card_number": f"4149{i:012d}", "bank_name": "Soak", "holder_name": "SOAK",
+            "limit": 1e15, "currency": "UAH"
+        })
+        headers["traders"].append(trader_headers)
+    for i in range(args.users):
+        await create_user(db, f"soak-user{i}@test.com")
+        headers["users"].append(await login(http, f"soak-user{i}@test.com"))
+    return headers
+
+
+async def _stop_workers(stop, sessions, background, grace):
+    """Stop sessions via `stop` and background loops via cancel(); names of tasks still running after `grace`."""
+    stop.set()
+    for task in background:
+        task.cancel()
+    workers = sessions + background
+    _, stuck = await asyncio.wait(workers, timeout=grace)
+    if stuck:
+        for task in stuck:
+            task.cancel()
+        _, stuck = await asyncio.wait(stuck, timeout=grace)
+    return sorted(task.get_coro().__qualname__ for task in stuck)
+
+
+def _take_sample(started, recorder, lag_state, baseline):
+    window = sorted(recorder.drain_window())
+    top = tracemalloc.take_snapshot().compare_to(baseline, "lineno")[:5]
+    sample = {
+        "elapsed_s": round(time.monotonic() - started, 1),
+        "rss_mb": round(rss_mb(), 2),
+        "tasks": len(asyncio.all_tasks()),
+        "loop_lag_ms": round(lag_state["max_lag_ms"], 2),
+        "requests": len(window),
+        "p50_ms": round(window[len(window) // 2], 2) if window else 0.0,
+        "p99_ms": round(window[int(len(window) * 0.99)], 2) if window else 0.0,
+        "server_errors": recorder.server_errors,
+        "top_allocators": [
+            f"{stat.traceback[0].filename}:{stat.traceback[0].lineno} {stat.size_diff / 1024:+.0f} KiB"
+            for stat in top
+        ],
+    }
+    lag_state["max_lag_ms"] = 0.0
+    return sample
+
+
+async def run_soak(args, report=None):
+    if TEST_MONGO_URL:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        mongo = AsyncIOMotorClient(TEST_MONGO_URL, tz_aware=True)
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        mongo = AsyncMongoMockClient(tz_aware=True)
+    db_name = f"skypall_soak_{uuid.uuid4().hex[:8]}"
+    saved = (server.db, server.reporting_db, server.hash_password, dict(server._token_epochs_state))
+    server.db = server.reporting_db = mongo[db_name]
+    server.hash_password = fast_hash
+    server._token_epochs_state["loaded"] = True
+
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    lag_state = {"max_lag_ms": 0.0}
+    samples = []
+    stuck = []
+    stop = asyncio.Event()
+    tracemalloc.start()
+    try:
+        await server.ensure_indexes()
+        baseline = tracemalloc.take_snapshot()
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://soak") as http:
+            headers = await _seed(server.db, http, args)
+            background = [asyncio.create_task(_measure_loop_lag(0.1, lag_state)),
+                          asyncio.create_task(server.outbox_consumer()),
+                          asyncio.create_task(server.expiry_sweeper())]
+            sessions = [asyncio.create_task(_admin_session(http, recorder, headers["admin"], args, rng, stop))]
+            sessions += [asyncio.create_task(_trader_session(http, recorder, h, args, rng, stop))
+                         for h in headers["traders"]]
+            sessions += [asyncio.create_task(_user_session(http, recorder, h, args, rng, stop))
+                         for h in headers["users"]]
+
+            started = time.monotonic()
+            try:
+                while time.monotonic() - started < args.duration:
+                    await asyncio.sleep(args.sample_interval)
+                    if not TEST_MONGO_URL:
+                        await _purge_settled(server.db)
+                    sample = _take_sample(started, recorder, lag_state, baseline)
+                    samples.append(sample)
+                    if report:
+                        report.write(json.dumps(sample) + "\n")
+                        report.flush()
+                    print(f"[{sample['elapsed_s']:8.0f}s] rss {sample['rss_mb']:8.1f} MB  tasks {sample['tasks']:4d}  "
+                          f"lag {sample['loop_lag_ms']:7.1f} ms  p99 {sample['p99_ms']:7.1f} ms  "
+                          f"{sample['requests']} requests", flush=True)
+            finally:
+                stuck = await _stop_workers(stop, sessions, background, args.shutdown_grace)
+    finally:
+        tracemalloc.stop()
+        if TEST_MONGO_URL:
+            await mongo.drop_database(db_name)
+            mongo.close()
+        server.db, server.reporting_db, server.hash_password = saved[:3]
+        server._token_epochs_state.clear()
+        server._token_epochs_state.update(saved[3])
+
+    reasons = evaluate(samples, args.rss_slope, args.p99_growth, args.task_growth, args.warmup)
+    if recorder.server_errors:
+        reasons.append(f"{recorder.server_errors} server errors")
+    if stuck:
+        reasons.append(f"tasks did not stop within {args.shutdown_grace}s: {', '.join(stuck)}")
+    return {"samples": samples, "reasons": reasons, "requests": recorder.requests,
+            "client_errors": recorder.client_errors}
+
+
+def parser():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--duration", type=float, default=4 * 3600, help="seconds")
+    p.add_argument("--sample-interval", type=float, default=60)
+    p.add_argument("--poll-interval", type=float, default=10, help="dashboard refresh period")
+    p.add_argument("--users", type=int, default=50)
+    p.add_argument("--traders", type=int, default=10)
+    p.add_argument("--request-probability", type=float, default=0.2)
+    p.add_argument("--rss-slope", type=float, default=10.0, help="max RSS growth, MB/hour")
+    p.add_argument("--p99-growth", type=float, default=0.5, help="max relative p99 growth")
+    p.add_argument("--task-growth", type=int, default=50)
+    p.add_argument("--warmup", type=float, default=0.1, help="fraction of samples ignored")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--shutdown-grace", type=float, default=5, help="seconds to wait for tasks to stop")
+    p.add_argument("--report", help="write samples as JSON lines")
+    return p
+
+
+def main():
+    args = parser().parse_args()
+    report = open(args.report, "w") if args.report else None
+    try:
+        result = asyncio.run(run_soak(args, report))
+    finally:
+        if report:
+            report.close()
+    for reason in result["reasons"]:
+        print(f"FAIL: {reason}")
+    print(f"{result['requests']} requests, {result['client_errors']} expected 4xx responses")
+    sys.exit(1 if result["reasons"] else 0)
+
+
+if __name__ == "__main__":
+    main()
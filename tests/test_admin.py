@@ -0,0 +1,270 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from .conftest import create_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_admin_routes_require_admin(client, user_headers):
+    for path in ("/api/admin/users", "/api/admin/traders", "/api/admin/transactions", "/api/admin/settings"):
+        assert (await client.get(path, headers=user_headers)).status_code == 403
+
+
+async def test_user_search_and_pagination(client, database, admin_headers):
+    for i in range(5):
+        await create_user(database, f"Alice{i}@example.com")
+    await create_user(database, "bob@example.com", is_blocked=True)
+
+    response = await client.get("/api/admin/users?q=alice&limit=2", headers={**admin_headers, "Origin": "https://admin.example.com"})
+    assert response.headers["X-Total-Count"] == "5"
+    # Browsers only let the admin panel read headers CORS exposes
+    assert "X-Total-Count" in response.headers["access-control-expose-headers"]
+    assert len(response.json()) == 2
+    assert all("password_hash" not in u for u in response.json())
+
+    blocked = await client.get("/api/admin/users?is_blocked=true", headers=admin_headers)
+    assert [u["email"] for u in blocked.json()] == ["bob@example.com"]
+
+
+async def test_trader_search_by_nickname_or_phone(client, trader, admin_headers):
+    by_nickname = await client.get("/api/admin/traders?q=test", headers=admin_headers)
+    by_phone = await client.get("/api/admin/traders?q=38067", headers=admin_headers)
+    nothing = await client.get("/api/admin/traders?q=zzz", headers=admin_headers)
+    assert [t["email"] for t in by_nickname.json()] == ["trader@test.com"]
+    assert len(by_phone.json()) == 1
+    assert nothing.json() == []
+
+    formatted = await client.get("/api/admin/traders", headers=admin_headers, params={"q": "+380 (67) 12"})
+    assert len(formatted.json()) == 1
+    # Digits inside a nickname search do not turn it into a phone search
+    nickname_with_digit = await client.get("/api/admin/traders?q=zz3", headers=admin_headers)
+    assert nickname_with_digit.json() == []
+
+
+async def test_transaction_filters(client, trader, user_headers, admin_headers):
+    for amount in (10, 50, 100):
+        await client.post("/api/user/request-card", headers=user_headers, json={"amount": amount})
+
+    all_txns = await client.get("/api/admin/transactions", headers=admin_headers)
+    assert all_txns.headers["X-Total-Count"] == "3"
+    large = await client.get("/api/admin/transactions?amount_min=2000", headers=admin_headers)
+    assert len(large.json()) == 2
+    completed = await client.get("/api/admin/transactions?status=completed", headers=admin_headers)
+    assert completed.json() == []
+    by_trader = await client.get(f"/api/admin/transactions?trader_id={trader['profile']['id']}&currency=UAH", headers=admin_headers)
+    assert len(by_trader.json()) == 3
+
+
+async def test_date_filter_matches_legacy_string_dates(client, database, trader, user_headers, admin_headers):
+    for amount in (10, 50):
+        await client.post("/api/user/request-card", headers=user_headers, json={"amount": amount})
+    legacy = await database.transactions.find_one({})
+    await database.transactions.update_one({"id": legacy["id"]}, {"$set": {"created_at": legacy["created_at"].isoformat()}})
+
+    now = datetime.now(timezone.utc)
+    params = {"date_from": (now - timedelta(hours=1)).isoformat(), "date_to": (now + timedelta(hours=1)).isoformat()}
+    today = await client.get("/api/admin/transactions", headers=admin_headers, params=params)
+    assert today.headers["X-Total-Count"] == "2"
+    assert legacy["id"] in [txn["id"] for txn in today.json()]
+    tomorrow = await client.get("/api/admin/transactions", headers=admin_headers, params={"date_from": params["date_to"]})
+    assert tomorrow.json() == []
+
+    # Bounds sent with an offset still compare correctly against the UTC legacy strings
+    kyiv = timezone(timedelta(hours=3))
+    local = {"date_from": (now - timedelta(hours=1)).astimezone(kyiv).isoformat(),
+             "date_to": (now + timedelta(hours=1)).astimezone(kyiv).isoformat()}
+    in_kyiv = await client.get("/api/admin/transactions", headers=admin_headers, params=local)
+    assert in_kyiv.headers["X-Total-Count"] == "2"
+
+
+async def test_add_balance_and_block_trader(client, trader, admin_headers):
+    trader_id = trader["profile"]["id"]
+    added = await client.post(f"/api/admin/traders/{trader_id}/add-balance", headers=admin_headers, json={"amount": 250})
+    assert added.json()["new_balance"] == 1250
+
+    profile = await client.get("/api/trader/profile", headers=trader["headers"])
+    assert profile.json()["usdt_balance"] == 1250
+    blocked = await client.put(f"/api/admin/traders/{trader_id}/block", headers=admin_headers)
+    assert blocked.json()["is_blocked"] is True
+
+
+async def test_settings_update_is_visible_immediately(client, admin_headers):
+    assert (await client.get("/api/settings/public")).json()["deposit_wallet_address"]
+    await client.put("/api/admin/settings", headers=admin_headers, json={
+        "commission_rate": 5, "usd_to_uah_rate": 40, "deposit_wallet_address": "TNewWallet"
+    })
+    assert (await client.get("/api/settings/public")).json() == {"deposit_wallet_address": "TNewWallet"}
+
+
+async def test_outbox_delivers_notifications_once(client, database, trader, user_headers):
+    txn_id = (await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10})).json()["transaction_id"]
+    await client.post(f"/api/user/confirm-payment/{txn_id}", headers=user_headers)
+
+    assert await server.drain_outbox_batch() == 2
+    assert await server.drain_outbox_batch() == 0
+    assert await database.audit_log.count_documents({}) == 2
+
+    notifications = (await client.get("/api/trader/notifications", headers=trader["headers"])).json()
+    assert [n["transaction_id"] for n in notifications] == [txn_id]
+
+
+async def test_outbox_retries_only_the_events_a_subscriber_rejected(client, database, trader, user_headers, monkeypatch):
+    txn_id = (await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10})).json()["transaction_id"]
+    await client.post(f"/api/user/confirm-payment/{txn_id}", headers=user_headers)
+
+    async def broken_notifier(event):
+        raise RuntimeError("notifications down")
+    monkeypatch.setitem(server.subscribers.handlers, "transaction.user_confirmed", [broken_notifier])
+
+    assert await server.drain_outbox_batch() == 2
+    created = await database.outbox.find_one({"type": "transaction.created"})
+    confirmed = await database.outbox.find_one({"type": "transaction.user_confirmed"})
+    assert created["status"] == "delivered"
+    assert confirmed["status"] == "pending" and confirmed["attempts"] == 1
+    assert confirmed["last_error"] == "subscribers: broken_notifier: notifications down"
+    assert confirmed["delivered_to"] == ["log"]
+
+
+def command_events(command_name: str, collection: str, duration_micros: int, request_id: int):
+    started = SimpleNamespace(connection_id=("db", 27017), request_id=request_id,
+                              command_name=command_name, command={command_name: collection})
+    finished = SimpleNamespace(connection_id=("db", 27017), request_id=request_id,
+                               command_name=command_name, duration_micros=duration_micros)
+    return started, finished
+
+
+def test_query_profiler_attributes_commands_to_the_current_request():
+    listener = server.QueryProfiler()
+    find_started, find_finished = command_events("find", "cards", 4_000, 1)
+    listener.started(find_started)  # before any request: ignored
+
+    profile = server.RequestProfile()
+    token = server.current_profile.set(profile)
+    try:
+        update_started, update_finished = command_events("update", "traders", 1_500, 2)
+        listener.started(find_started)
+        listener.started(update_started)
+        listener.succeeded(update_finished)
+        listener.failed(find_finished)
+    finally:
+        server.current_profile.reset(token)
+    listener.succeeded(find_finished)  # after the request: ignored
+
+    assert profile.query_count == 2
+    assert profile.db_ms == pytest.approx(5.5)
+    assert profile.slowest() == [(4.0, "find", "cards"), (1.5, "update", "traders")]
+
+
+async def test_slow_requests_are_logged_with_server_timing(client, monkeypatch, caplog):
+    load_settings = server.load_settings
+    listener = server.QueryProfiler()
+
+    async def profiled_load_settings():
+        # mongomock emits no command events, so report what a real driver would
+        for request_id, duration_micros in enumerate((30_000, 12_500)):
+            started, finished = command_events("find", "settings", duration_micros, request_id)
+            listener.started(started)
+            listener.succeeded(finished)
+        return await load_settings()
+
+    monkeypatch.setattr(server, "load_settings", profiled_load_settings)
+    monkeypatch.setattr(server, "route_db_stats", {})
+    monkeypatch.setattr(server, "DB_PROFILER_SERVER_TIMING", True)
+    monkeypatch.setattr(server, "SLOW_REQUEST_QUERY_COUNT", 100)
+    monkeypatch.setattr(server, "SLOW_REQUEST_DB_MS", 1000)
+
+    with caplog.at_level("WARNING", logger=server.logger.name):
+        fast = await client.get("/api/settings/public")
+    assert fast.headers["server-timing"] == 'db;dur=42.50;desc="2 queries"'
+    assert server.route_db_stats["GET /api/settings/public"] == {
+        "requests": 1, "queries": 2, "db_ms": pytest.approx(42.5), "max_queries": 2
+    }
+    assert not [r for r in caplog.records if r.getMessage().startswith("Slow request")]
+
+    monkeypatch.setattr(server, "SLOW_REQUEST_DB_MS", 40)
+    with caplog.at_level("WARNING", logger=server.logger.name):
+        await client.get("/api/settings/public")
+    slow = [r.getMessage() for r in caplog.records if r.getMessage().startswith("Slow request")]
+    assert slow == [
+        "Slow request GET /api/settings/public: 2 queries, 42.5ms in MongoDB; "
+        "slowest: find settings 30.0ms, find settings 12.5ms"
+    ]
+
+    monkeypatch.setattr(server, "DB_PROFILER_SERVER_TIMING", False)
+    assert "server-timing" not in (await client.get("/api/settings/public")).headers
+
+
+async def test_unmatched_requests_share_one_profile_key(client, monkeypatch):
+    monkeypatch.setattr(server, "route_db_stats", {})
+    for path in ("/api/nope-1", "/api/nope-2", "/random/scan.php"):
+        assert (await client.get(path)).status_code == 404
+    assert (await client.request("PURGE", "/api/settings/public")).status_code == 405
+    await client.get("/api/settings/public")
+    assert server.route_db_stats.keys() == {"<unmatched>", "GET /api/settings/public"}
+    assert server.route_db_stats["<unmatched>"]["requests"] == 4
+
+
+async def test_admin_stats(client, trader, user_headers, admin_headers):
+    await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10})
+    stats = (await client.get("/api/stats", headers=admin_headers)).json()
+    assert stats["total_traders"] == 1
+    assert stats["total_users"] == 1
+    assert stats["total_transactions"] == 1
+
+
+async def test_liveness(client):
+    response = await client.get("/api/health/live")
+    assert response.status_code == 200
+    assert response.json()["status"] == "alive"
+
+
+async def test_saturated_pool_stays_ready(client, monkeypatch):
+    class Admin:
+        async def command(self, name):
+            return {"ok": 1}
+
+    class Client:
+        admin = Admin()
+
+    monkeypatch.setattr(server, "client", Client())
+    monkeypatch.setitem(server.startup_state, "ready", True)
+    monkeypatch.setattr(server, "pool_stats", lambda: {"checked_out": 100, "saturation": 1.0})
+
+    response = await client.get("/api/health/ready")
+    assert response.status_code == 200
+    assert response.json()["pool"]["saturated"] is True
+
+
+async def test_failed_warm_up_is_retried_until_ready(client, database, trader, monkeypatch):
+    class Admin:
+        async def command(self, name):
+            return {"ok": 1}
+
+    class Client:
+        admin = Admin()
+
+    ensure_indexes = server.ensure_indexes
+    failures = [RuntimeError("not primary"), RuntimeError("not primary")]
+
+    async def flaky_ensure_indexes():
+        if failures:
+            raise failures.pop()
+        await ensure_indexes()
+
+    monkeypatch.setattr(server, "client", Client())
+    monkeypatch.setattr(server, "ensure_indexes", flaky_ensure_indexes)
+    monkeypatch.setattr(server, "startup_state", {**server.startup_state, "ready": False, "warmup_attempts": 0})
+    monkeypatch.setattr(server, "WARMUP_RETRY_SECONDS", 0)
+
+    assert await server.warm_up() is False
+    assert (await client.get("/api/health/ready")).status_code == 503
+
+    await server.warm_up_until_ready()
+    response = await client.get("/api/health/ready")
+    assert response.status_code == 200
+    assert response.json()["startup"]["warmup_attempts"] == 3
+    assert response.json()["startup"]["warmup_active_cards"] == 1
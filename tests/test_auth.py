@@ -0,0 +1,126 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from .conftest import create_user, login
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_register_login_and_me(client):
+    response = await client.post("/api/auth/register", json={"email": "new@test.com", "password": "pw123456"})
+    assert response.status_code == 200
+    assert response.json()["user"]["role"] == "user"
+
+    headers = await login(client, "new@test.com", "pw123456")
+    me = await client.get("/api/auth/me", headers=headers)
+    assert me.status_code == 200
+    assert me.json()["email"] == "new@test.com"
+    assert me.json()["trader"] is None
+
+
+async def test_register_duplicate_email(client):
+    await client.post("/api/auth/register", json={"email": "dup@test.com", "password": "pw"})
+    response = await client.post("/api/auth/register", json={"email": "dup@test.com", "password": "pw"})
+    assert response.status_code == 400
+
+
+async def test_login_rejects_bad_password_and_blocked_user(client, database):
+    await create_user(database, "blocked@test.com", is_blocked=True)
+    await create_user(database, "ok@test.com")
+
+    wrong = await client.post("/api/auth/login", json={"email": "ok@test.com", "password": "wrong"})
+    assert wrong.status_code == 401
+    blocked = await client.post("/api/auth/login", json={"email": "blocked@test.com", "password": "secret123"})
+    assert blocked.status_code == 403
+
+
+async def test_missing_and_invalid_token(client):
+    assert (await client.get("/api/auth/me")).status_code == 403
+    response = await client.get("/api/auth/me", headers={"Authorization": "Bearer not-a-token"})
+    assert response.status_code == 401
+
+
+async def test_current_token_authorises_from_claims(client, database, user_headers):
+    # The claims fast path never reads the user document
+    await database.users.delete_many({})
+    me = await client.get("/api/auth/me", headers=user_headers)
+    assert me.status_code == 200
+    assert me.json()["email"] == "user@test.com"
+
+
+async def test_blocking_revokes_existing_tokens(client, database, admin_headers, user_headers):
+    user = await database.users.find_one({"email": "user@test.com"})
+    response = await client.put(f"/api/admin/users/{user['id']}/block", headers=admin_headers)
+    assert response.json()["is_blocked"] is True
+
+    me = await client.get("/api/auth/me", headers=user_headers)
+    assert me.status_code == 403
+
+
+async def test_only_recent_epoch_bumps_are_loaded(database):
+    now = datetime.now(timezone.utc)
+    bumps = {
+        "recent": {"token_epoch": 2, "token_epoch_at": now - timedelta(hours=1)},
+        "old": {"token_epoch": 5, "token_epoch_at": now - timedelta(hours=server.JWT_EXPIRATION_HOURS + 1)},
+        "legacy": {"token_epoch": 1}
+    }
+    for user_id, bump in bumps.items():
+        await create_user(database, f"{user_id}@test.com", id=user_id)
+        await database.users.update_one({"id": user_id}, {"$set": bump})
+    await server.backfill_token_epoch_times()
+
+    # A bump made here while the refresh is running outranks what the refresh read
+    server.remember_token_epoch("recent", 3, now)
+    server.remember_token_epoch("expired", 1, now - timedelta(hours=server.JWT_EXPIRATION_HOURS + 1))
+    await server.refresh_token_epochs()
+    assert server.token_epochs == {"recent": 3, "legacy": 1}
+
+
+async def test_rotated_key_is_picked_up_without_restart(client, monkeypatch, tmp_path, user_headers):
+    keys_file = tmp_path / "jwt_keys.json"
+    keys = {"default": server.JWT_SECRET, "k2": "rotated-secret-of-thirty-two-bytes"}
+    keys_file.write_text(json.dumps({"active_kid": "k2", "keys": keys}))
+    monkeypatch.setattr(server, "JWT_KEYS_FILE", str(keys_file))
+    monkeypatch.setattr(server, "jwt_keyring", server.JWTKeyring())
+
+    await create_user(server.db, "rotated@test.com")
+    headers = await login(client, "rotated@test.com")
+    token = headers["Authorization"].split()[1]
+    assert server.jwt.get_unverified_header(token)["kid"] == "k2"
+
+    # Tokens signed with the previous key stay valid while the file lists it
+    for h in (headers, user_headers):
+        assert (await client.get("/api/auth/me", headers=h)).status_code == 200
+
+
+async def test_keys_removed_from_the_file_are_retired(client, monkeypatch, tmp_path, user_headers):
+    keys_file = tmp_path / "jwt_keys.json"
+    keys_file.write_text(json.dumps({"active_kid": "k2", "keys": {"k1": "leaked-secret-of-thirty-two-bytes!", "k2": "rotated-secret-of-thirty-two-bytes"}}))
+    monkeypatch.setattr(server, "JWT_KEYS_FILE", str(keys_file))
+    monkeypatch.setattr(server, "JWT_KEYS_RELOAD_SECONDS", 0)
+    monkeypatch.setattr(server, "jwt_keyring", server.JWTKeyring())
+    await create_user(server.db, "rotated@test.com")
+    leaked = server.jwt.encode({"user_id": "x", "email": "x@test.com", "role": "admin", "epoch": 0,
+                                "exp": datetime.now(timezone.utc) + timedelta(hours=1)},
+                               "leaked-secret-of-thirty-two-bytes!", algorithm=server.JWT_ALGORITHM, headers={"kid": "k1"})
+    current = await login(client, "rotated@test.com")
+    assert (await client.get("/api/auth/me", headers={"Authorization": f"Bearer {leaked}"})).status_code == 200
+
+    keys_file.write_text(json.dumps({"active_kid": "k2", "keys": {"k2": "rotated-secret-of-thirty-two-bytes"}}))
+    os.utime(keys_file, (time.time() + 10, time.time() + 10))
+    assert (await client.get("/api/auth/me", headers={"Authorization": f"Bearer {leaked}"})).status_code == 401
+    assert (await client.get("/api/auth/me", headers=current)).status_code == 200
+    # The environment secret is not a key of its own once the file has loaded
+    assert (await client.get("/api/auth/me", headers=user_headers)).status_code == 401
+
+
+async def test_me_is_fast(client, user_headers, within_budget):
+    await client.get("/api/auth/me", headers=user_headers)
+    with within_budget(50):
+        for _ in range(10):
+            assert (await client.get("/api/auth/me", headers=user_headers)).status_code == 200
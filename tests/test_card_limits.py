@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2026, 10, 19, 12, 30, tzinfo=timezone.utc)
+
+
+async def add_card(client, trader, period: str, limit: float = 1000) -> dict:
+    response = await client.post("/api/trader/cards", headers=trader["headers"], json={
+        "card_number": "5375000055556666", "bank_name": "Privat", "holder_name": "TEST TRADER",
+        "limit": limit, "currency": "EUR", "limit_period": period
+    })
+    assert response.status_code == 200
+    return response.json()
+
+
+async def card_state(database, card_id: str) -> dict:
+    return await database.cards.find_one({"id": card_id}, {"_id": 0})
+
+
+def test_window_starts_are_utc_period_boundaries():
+    assert server.card_window_start("daily", NOW) == datetime(2026, 10, 19, tzinfo=timezone.utc)
+    assert server.card_window_start("monthly", NOW) == datetime(2026, 10, 1, tzinfo=timezone.utc)
+    assert server.card_window_start("rolling_24h", NOW) == datetime(2026, 10, 18, 13, tzinfo=timezone.utc)
+    assert server.card_window_start("none", NOW) is None
+    assert server.usage_bucket_key(NOW) == "2026101912"
+
+
+async def test_daily_window_resets_and_ignores_late_releases(client, database, trader):
+    card = await add_card(client, trader, "daily")
+    await database.cards.update_one({"id": card["id"]}, {"$set": {"window_start": server.card_window_start("daily", NOW)}})
+    claimed, _ = await server.claim_card("EUR", 600, NOW)
+    assert claimed["id"] == card["id"]
+    assert (await server.claim_card("EUR", 600, NOW))[0] is None
+
+    tomorrow = NOW + timedelta(days=1)
+    assert await server.roll_card_limits(tomorrow) == 1
+    assert await server.roll_card_limits(tomorrow) == 0
+    state = await card_state(database, card["id"])
+    assert state["current_usage"] == 0
+    assert server.as_datetime(state["window_start"]) == server.card_window_start("daily", tomorrow)
+
+    # Yesterday's allocation expiring must not free today's headroom
+    await server.release_card_usage(card["id"], 600, "EUR", NOW)
+    assert (await card_state(database, card["id"]))["current_usage"] == 0
+
+    # A process whose clock still reads yesterday does not roll the window back,
+    # and its claims count against the window that is already current
+    await server.claim_card("EUR", 100, tomorrow)
+    assert await server.roll_card_limits(NOW) == 0
+    assert (await server.claim_card("EUR", 200, NOW))[0]["id"] == card["id"]
+    state = await card_state(database, card["id"])
+    assert state["current_usage"] == 300
+    assert server.as_datetime(state["window_start"]) == server.card_window_start("daily", tomorrow)
+
+
+async def test_rolling_window_drops_old_buckets(client, database, trader):
+    card = await add_card(client, trader, "rolling_24h")
+    earlier = NOW - timedelta(hours=3)
+    await database.cards.update_one({"id": card["id"]}, {"$set": {"window_start": server.card_window_start("rolling_24h", earlier)}})
+    await server.claim_card("EUR", 300, earlier)
+    assert await server.roll_card_limits(NOW) == 1
+    await server.claim_card("EUR", 200, NOW)
+    await server.claim_card("EUR", 100, NOW)
+    state = await card_state(database, card["id"])
+    assert state["current_usage"] == 600
+    assert state["usage_buckets"] == {"2026101909": 300, "2026101912": 300}
+
+    await server.release_card_usage(card["id"], 100, "EUR", NOW)
+    assert await server.roll_card_limits(earlier + timedelta(hours=24)) == 1
+    state = await card_state(database, card["id"])
+    assert state["current_usage"] == 200
+    assert state["usage_buckets"] == {"2026101912": 200}
+
+
+async def test_allocation_rolls_a_stale_window_first(client, database, trader, user_headers):
+    card = await add_card(client, trader, "daily", limit=10_000)
+    await database.cards.update_many({"id": {"$ne": card["id"]}}, {"$set": {"status": "paused"}})
+    yesterday = server.card_window_start("daily", datetime.now(timezone.utc)) - timedelta(days=1)
+    await database.cards.update_one({"id": card["id"]}, {"$set": {"window_start": yesterday, "current_usage": 10_000}})
+
+    response = await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10, "currency": "EUR"})
+    assert response.status_code == 200
+    assert (await card_state(database, card["id"]))["current_usage"] == response.json()["card"]["amount"]
+
+
+async def test_switching_periods_keeps_the_usage(client, database, trader):
+    card = await add_card(client, trader, "none")
+    await server.claim_card("EUR", 400)
+    switched = await client.put(f"/api/trader/cards/{card['id']}", headers=trader["headers"], json={"limit_period": "rolling_24h"})
+    assert switched.status_code == 200
+    assert switched.json()["current_usage"] == 400
+    assert list(switched.json()["usage_buckets"].values()) == [400]
+
+    invalid = await client.put(f"/api/trader/cards/{card['id']}", headers=trader["headers"], json={"limit_period": "weekly"})
+    assert invalid.status_code == 400
+    created = await client.post("/api/trader/cards", headers=trader["headers"], json={
+        "card_number": "1", "bank_name": "Mono", "holder_name": "X", "limit": 1, "limit_period": "hourly"
+    })
+    assert created.status_code == 400
@@ -0,0 +1,76 @@
+import pytest
+
+import server
+from .conftest import create_user
+
+pytestmark = pytest.mark.anyio
+
+
+def test_encoding_negotiation():
+    assert server.negotiate_encoding("gzip, br;q=0") == "gzip"
+    assert server.negotiate_encoding("identity") is None
+    assert server.negotiate_encoding("gzip;q=0, *;q=0") is None
+    assert server.negotiate_encoding("*") == ("br" if server.brotli else "gzip")
+
+
+async def test_large_responses_are_compressed(client, database, admin_headers):
+    for i in range(30):
+        await create_user(database, f"compressed{i}@example.com")
+    plain = await client.get("/api/admin/users", headers={**admin_headers, "Accept-Encoding": "identity"})
+    gzipped = await client.get("/api/admin/users", headers={**admin_headers, "Accept-Encoding": "gzip"})
+    assert "content-encoding" not in plain.headers
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in gzipped.headers["vary"]
+    assert gzipped.num_bytes_downloaded < plain.num_bytes_downloaded / 3
+    assert gzipped.json() == plain.json()
+
+    small = await client.get("/api/settings/public", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+    if server.brotli is not None:
+        compressed = await client.get("/api/admin/users", headers={**admin_headers, "Accept-Encoding": "gzip, br"})
+        assert compressed.headers["content-encoding"] == "br"
+        assert compressed.json() == plain.json()
+
+
+async def test_sparse_fields_on_transaction_lists(client, trader, user_headers, admin_headers):
+    await client.post("/api/user/request-card", headers=user_headers, json={"amount": 100})
+
+    mine = await client.get("/api/user/transactions?fields=id,amount", headers=user_headers)
+    assert [set(txn) for txn in mine.json()] == [{"id", "amount"}]
+    amount = mine.json()[0]["amount"]
+    archived = await client.get("/api/user/transactions?fields=amount&include_archived=true", headers=user_headers)
+    assert archived.json() == [{"amount": amount}]
+    admin = await client.get("/api/admin/transactions?fields=status", headers=admin_headers)
+    assert admin.json() == [{"status": "pending"}]
+
+    headers = trader["headers"]
+    without_card = await client.get("/api/trader/transactions?fields=id,status", headers=headers)
+    assert set(without_card.json()[0]) == {"id", "status"}
+    with_bank = await client.get("/api/trader/transactions?fields=amount,card.bank_name", headers=headers)
+    assert with_bank.json() == [{"amount": amount, "card": {"bank_name": "Mono"}}]
+    whole_card = await client.get("/api/trader/transactions?fields=card", headers=headers)
+    assert whole_card.json()[0]["card"]["id"] == trader["card"]["id"]
+
+
+async def test_sparse_fields_cover_fields_set_after_creation(client, trader, user_headers, admin_headers):
+    created = await client.post("/api/user/request-card", headers=user_headers, json={"amount": 100})
+    txn_id = created.json()["transaction_id"]
+    await client.post(f"/api/user/confirm-payment/{txn_id}", headers=user_headers)
+    completed = await client.post(f"/api/trader/confirm-payment/{txn_id}", headers=trader["headers"])
+    assert completed.status_code == 200
+
+    mine = await client.get("/api/user/transactions?fields=usdt_amount,completed_at", headers=user_headers)
+    assert mine.status_code == 200
+    assert mine.json()[0]["usdt_amount"] == 100
+    admin = await client.get("/api/admin/transactions?fields=status,cancelled_at", headers=admin_headers)
+    assert admin.status_code == 200
+    assert admin.json() == [{"status": "completed", "cancelled_at": None}]
+
+
+async def test_unknown_fields_are_rejected(client, trader, user_headers, admin_headers):
+    assert (await client.get("/api/user/transactions?fields=nope", headers=user_headers)).status_code == 400
+    assert (await client.get("/api/admin/users?fields=password_hash", headers=admin_headers)).status_code == 400
+    assert (await client.get("/api/trader/transactions?fields=card.nope", headers=trader["headers"])).status_code == 400
+    emails = await client.get("/api/admin/users?fields=email", headers=admin_headers)
+    assert all(set(user) == {"email"} for user in emails.json())
@@ -0,0 +1,78 @@
+import uuid
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.read_preferences import ReadPreference
+
+import server
+from .conftest import create_user, fast_hash, login
+
+pytestmark = pytest.mark.anyio
+
+
+def test_reporting_reads_prefer_fresh_secondaries():
+    assert server.reporting_read_preference.mongos_mode == "secondaryPreferred"
+    assert server.reporting_read_preference.max_staleness >= 90
+    assert server.reporting_db.read_preference == server.reporting_read_preference
+    assert server.client.read_preference == ReadPreference.PRIMARY
+
+
+async def test_reporting_routes_read_the_reporting_database(client, database, trader, user_headers, admin_headers, monkeypatch):
+    # A second database standing in for a lagging secondary: reporting routes
+    # must read it, allocation must keep using the primary
+    replica = AsyncMongoMockClient(tz_aware=True)[f"replica_{uuid.uuid4().hex[:8]}"]
+    await create_user(replica, "only-on-replica@test.com")
+    monkeypatch.setattr(server, "reporting_db", replica)
+
+    users = await client.get("/api/admin/users", headers=admin_headers)
+    assert [u["email"] for u in users.json()] == ["only-on-replica@test.com"]
+    stats = await client.get("/api/stats", headers=admin_headers)
+    assert stats.json()["total_users"] == 1 and stats.json()["total_traders"] == 0
+
+    allocated = await client.post("/api/user/request-card", headers=user_headers, json={"amount": 100})
+    assert allocated.status_code == 200
+    assert (await client.get("/api/admin/transactions", headers=admin_headers)).json() == []
+
+
+async def test_read_after_must_be_an_operation_time(client, admin_headers):
+    response = await client.get("/api/admin/users", headers={**admin_headers, "X-Read-After": "yesterday"})
+    assert response.status_code == 400
+    # Without a replica set the header is accepted and ignored
+    response = await client.get("/api/admin/users", headers={**admin_headers, "X-Read-After": "1700000000.1"})
+    assert response.status_code == 200
+
+
+@pytest.fixture
+async def replica_set_client(replica_set, monkeypatch):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    mongo = AsyncIOMotorClient(replica_set, tz_aware=True)
+    name = f"skypall_rs_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(server, "db", mongo[name])
+    monkeypatch.setattr(server, "reporting_db", mongo.get_database(name, read_preference=server.reporting_read_preference))
+    monkeypatch.setattr(server, "hash_password", fast_hash)
+    monkeypatch.setitem(server.mongo_topology, "transactions", True)
+    monkeypatch.setitem(server.mongo_topology, "sessions", True)
+    monkeypatch.setitem(server._token_epochs_state, "loaded", True)
+    for cache in (server._verified_tokens, server.token_epochs, server._token_epoch_bumped_at, server._archived_counts):
+        cache.clear()
+    await server.ensure_indexes()
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as http:
+        yield http
+    await mongo.drop_database(name)
+    mongo.close()
+
+
+async def test_admin_reads_its_own_writes_on_a_replica_set(replica_set_client):
+    await create_user(server.db, "admin@test.com", role="admin")
+    headers = await login(replica_set_client, "admin@test.com")
+    for i in range(10):
+        email = f"causal{i}@test.com"
+        created = await replica_set_client.post("/api/admin/users/create", headers=headers,
+                                                json={"email": email, "password": "secret123"})
+        operation_time = created.headers["X-Operation-Time"]
+        listed = await replica_set_client.get(f"/api/admin/users?q=causal{i}",
+                                              headers={**headers, "X-Read-After": operation_time})
+        assert [u["email"] for u in listed.json()] == [email]
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from . import soak
+
+pytestmark = pytest.mark.anyio
+
+
+def _samples(rss, p99, tasks=None):
+    return [
+        {"elapsed_s": i * 600, "rss_mb": r, "p99_ms": p, "tasks": (tasks or [20] * len(rss))[i]}
+        for i, (r, p) in enumerate(zip(rss, p99))
+    ]
+
+
+def test_flat_run_passes():
+    assert soak.evaluate(_samples([200, 201, 199, 200, 202, 200, 201, 200, 199, 200], [30] * 10)) == []
+
+
+def test_memory_and_latency_creep_fail():
+    reasons = soak.evaluate(_samples(
+        [200 + 10 * i for i in range(10)],
+        [20 + 5 * i for i in range(10)],
+        [20 + 20 * i for i in range(10)],
+    ))
+    assert len(reasons) == 3
+
+
+async def test_short_soak(database):
+    # SOAK_SECONDS=14400 turns this smoke run into a real soak
+    duration = float(os.environ.get("SOAK_SECONDS", "2"))
+    args = soak.parser().parse_args([
+        "--duration", str(duration),
+        "--sample-interval", str(max(0.5, duration / 60)),
+        "--poll-interval", "0.2",
+        "--users", "5",
+        "--traders", "2",
+        "--request-probability", "0.5",
+    ])
+    result = await soak.run_soak(args)
+    assert soak.server.db is database
+    assert result["samples"]
+    assert result["requests"] > 0
+    assert result["reasons"] == []
@@ -0,0 +1,91 @@
+import pytest
+
+from .conftest import create_user, fail_outbox_writes, login
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_become_trader(client, database):
+    await create_user(database, "future@test.com")
+    headers = await login(client, "future@test.com")
+    response = await client.post("/api/trader/register", headers=headers, json={
+        "name": "Future", "nickname": "Fut", "usdt_address": "TAddr", "phone": "+380 50 000 00 00"
+    })
+    assert response.status_code == 200
+    assert response.json()["phone_key"] == "380500000000"
+
+    # The role change makes the old token fall back to the database, which knows the new role
+    profile = await client.get("/api/trader/profile", headers=headers)
+    assert profile.status_code == 200
+    assert profile.json()["nickname"] == "Fut"
+
+
+async def test_user_without_profile_is_rejected(client, user_headers):
+    assert (await client.get("/api/trader/profile", headers=user_headers)).status_code == 403
+
+
+async def test_card_lifecycle(client, trader):
+    headers, card = trader["headers"], trader["card"]
+
+    cards = await client.get("/api/trader/cards", headers=headers)
+    assert [c["id"] for c in cards.json()] == [card["id"]]
+
+    updated = await client.put(f"/api/trader/cards/{card['id']}", headers=headers, json={"limit": 5000, "status": "paused"})
+    assert updated.status_code == 200
+    assert updated.json()["limit"] == 5000
+    assert updated.json()["status"] == "paused"
+
+    missing = await client.put("/api/trader/cards/nope", headers=headers, json={"limit": 1})
+    assert missing.status_code == 404
+
+    assert (await client.delete(f"/api/trader/cards/{card['id']}", headers=headers)).status_code == 200
+    assert (await client.delete(f"/api/trader/cards/{card['id']}", headers=headers)).status_code == 404
+
+
+async def test_transactions_embed_their_card(client, trader, user_headers):
+    await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10})
+    await client.post("/api/user/request-card", headers=user_headers, json={"amount": 20})
+
+    transactions = (await client.get("/api/trader/transactions", headers=trader["headers"])).json()
+    assert len(transactions) == 2
+    assert all(txn["card"]["id"] == trader["card"]["id"] for txn in transactions)
+
+
+async def test_confirm_requires_user_confirmation_and_balance(client, database, trader, user_headers):
+    txn_id = (await client.post("/api/user/request-card", headers=user_headers, json={"amount": 100})).json()["transaction_id"]
+
+    early = await client.post(f"/api/trader/confirm-payment/{txn_id}", headers=trader["headers"])
+    assert early.status_code == 400
+
+    await client.post(f"/api/user/confirm-payment/{txn_id}", headers=user_headers)
+    # Changed behind this process's back, as another worker would
+    await database.traders.update_one({"id": trader["profile"]["id"]}, {"$set": {"usdt_balance": 1.0}})
+
+    poor = await client.post(f"/api/trader/confirm-payment/{txn_id}", headers=trader["headers"])
+    assert poor.status_code == 400
+    assert poor.json()["detail"] == "Insufficient USDT balance"
+
+
+async def test_failed_completion_keeps_the_balance(client, database, trader, user_headers, monkeypatch):
+    txn_id = (await client.post("/api/user/request-card", headers=user_headers, json={"amount": 100})).json()["transaction_id"]
+    await client.post(f"/api/user/confirm-payment/{txn_id}", headers=user_headers)
+    insert_many = type(database.outbox).insert_many
+    fail_outbox_writes(database, monkeypatch)
+
+    with pytest.raises(ConnectionError):
+        await client.post(f"/api/trader/confirm-payment/{txn_id}", headers=trader["headers"])
+    assert (await database.traders.find_one({"id": trader["profile"]["id"]}))["usdt_balance"] == 1000
+    txn = await database.transactions.find_one({"id": txn_id})
+    assert txn["status"] == "user_confirmed" and "usdt_amount" not in txn
+
+    # Once the outbox is back the confirmation can simply be retried
+    monkeypatch.setattr(type(database.outbox), "insert_many", insert_many)
+    confirmed = await client.post(f"/api/trader/confirm-payment/{txn_id}", headers=trader["headers"])
+    assert confirmed.status_code == 200
+
+
+async def test_trader_routes_are_fast(client, trader, within_budget):
+    headers = trader["headers"]
+    with within_budget(100):
+        for path in ("/api/trader/profile", "/api/trader/cards", "/api/trader/transactions", "/api/stats"):
+            assert (await client.get(path, headers=headers)).status_code == 200
@@ -0,0 +1,208 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from .conftest import fail_outbox_writes
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_full_payment_flow(client, database, trader, user_headers, within_budget):
+    with within_budget(100):
+        requested = await client.post("/api/user/request-card", headers=user_headers, json={"amount": 100, "currency": "UAH"})
+        assert requested.status_code == 200
+        body = requested.json()
+        txn_id = body["transaction_id"]
+        assert body["card"]["card_number"] == trader["card"]["card_number"]
+        assert body["card"]["amount"] == round(100 * 41.5 * 1.09, 2)
+
+        assert (await client.post(f"/api/user/confirm-payment/{txn_id}", headers=user_headers)).status_code == 200
+        confirmed = await client.post(f"/api/trader/confirm-payment/{txn_id}", headers=trader["headers"])
+        assert confirmed.status_code == 200
+        assert confirmed.json()["usdt_sent"] == 100.0
+
+    txn = await database.transactions.find_one({"id": txn_id})
+    assert txn["status"] == "completed"
+    assert isinstance(txn["completed_at"], datetime)
+    card = await database.cards.find_one({"id": trader["card"]["id"]})
+    assert card["current_usage"] == body["card"]["amount"]
+    profile = await client.get("/api/trader/profile", headers=trader["headers"])
+    assert profile.json()["usdt_balance"] == pytest.approx(900.0)
+
+    # Confirming twice neither pays twice nor succeeds
+    again = await client.post(f"/api/trader/confirm-payment/{txn_id}", headers=trader["headers"])
+    assert again.status_code == 400
+    assert (await client.post(f"/api/user/confirm-payment/{txn_id}", headers=user_headers)).status_code == 400
+
+    stats = (await client.get("/api/stats", headers=user_headers)).json()
+    assert stats == {"completed_transactions": 1, "pending_transactions": 0}
+
+
+async def test_request_card_validation(client, user_headers):
+    negative = await client.post("/api/user/request-card", headers=user_headers, json={"amount": -100})
+    assert negative.status_code == 400
+    no_cards = await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10})
+    assert no_cards.status_code == 404
+
+
+async def test_request_card_without_headroom(client, trader, user_headers):
+    response = await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10_000})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "No card with sufficient limit"
+
+
+async def fill_card(database, card: dict, usage: float = 90_000):
+    await database.cards.update_one({"id": card["id"]}, {"$set": {"current_usage": usage}})
+
+
+async def test_waiting_request_is_matched_when_a_card_is_added(client, database, monkeypatch, trader, user_headers):
+    monkeypatch.setattr(server, "CARD_QUEUE_TIMEOUT_SECONDS", 5)
+    await fill_card(database, trader["card"])
+    waiting = asyncio.create_task(
+        client.post("/api/user/request-card", headers=user_headers, json={"amount": 1_000})
+    )
+    while not server.card_queue.depth("UAH"):
+        await asyncio.sleep(0.01)
+
+    await client.post("/api/trader/cards", headers=trader["headers"], json={
+        "card_number": "5375000033334444", "bank_name": "Privat",
+        "holder_name": "TEST TRADER", "limit": 500_000, "currency": "UAH"
+    })
+    response = await asyncio.wait_for(waiting, timeout=5)
+    assert response.status_code == 200
+    assert response.json()["card"]["card_number"] == "5375000033334444"
+    assert server.card_queue.snapshot()["woken"] == 1
+
+
+async def test_amounts_above_every_card_limit_fail_fast(client, monkeypatch, trader, user_headers):
+    monkeypatch.setattr(server, "CARD_QUEUE_TIMEOUT_SECONDS", 5)
+    # 5 000 USDT is over 200 000 UAH, more than the only card's limit
+    for _ in range(3):
+        too_large = await client.post("/api/user/request-card", headers=user_headers, json={"amount": 5_000})
+        assert too_large.status_code == 400
+    assert server.card_queue.snapshot()["enqueued"] == 0
+    assert (await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10})).status_code == 200
+
+
+async def test_new_requests_queue_behind_waiting_ones(client, database, monkeypatch, trader, user_headers):
+    monkeypatch.setattr(server, "CARD_QUEUE_TIMEOUT_SECONDS", 0.5)
+    await fill_card(database, trader["card"])
+    waiting = asyncio.create_task(
+        client.post("/api/user/request-card", headers=user_headers, json={"amount": 1_000})
+    )
+    while not server.card_queue.depth("UAH"):
+        await asyncio.sleep(0.01)
+
+    # The card has room for this one, but the FIFO head fits the card's limit and is still waiting
+    later = await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10})
+    assert later.status_code == 400
+    assert (await waiting).status_code == 400
+    assert (await database.cards.find_one({"id": trader["card"]["id"]}))["current_usage"] == 90_000
+    assert server.card_queue.snapshot()["enqueued"] == 2
+
+
+async def test_unservable_head_does_not_block_the_queue():
+    queue = server.CardMatchingQueue(policy="fifo")
+    head = asyncio.create_task(queue.wait("UAH", 5_000, timeout=5))
+    behind = asyncio.create_task(queue.wait("UAH", 100, timeout=5))
+    while queue.depth("UAH") < 2:
+        await asyncio.sleep(0)
+
+    # The only card big enough for the head was paused meanwhile
+    assert queue.notify("UAH", [500], largest_limit=1_000) == 1
+    assert await head is False
+    assert await behind is True
+    assert queue.snapshot()["unservable"] == 1
+
+
+async def test_amount_policy_lets_queued_small_requests_overtake(client, database, monkeypatch, trader, user_headers):
+    monkeypatch.setattr(server, "CARD_QUEUE_TIMEOUT_SECONDS", 0.5)
+    monkeypatch.setattr(server, "card_queue", server.CardMatchingQueue(policy="amount"))
+    await fill_card(database, trader["card"])
+    waiting = asyncio.create_task(
+        client.post("/api/user/request-card", headers=user_headers, json={"amount": 1_000})
+    )
+    while not server.card_queue.depth("UAH"):
+        await asyncio.sleep(0.01)
+
+    later = await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10})
+    assert later.status_code == 200
+    assert (await waiting).status_code == 400
+
+
+async def test_expired_transactions_release_card_usage(client, database, trader, user_headers):
+    txn_id = (await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10})).json()["transaction_id"]
+    await database.transactions.update_one(
+        {"id": txn_id}, {"$set": {"expires_at": datetime.now(timezone.utc) - timedelta(minutes=1)}}
+    )
+
+    assert await server.expire_pending_transactions() == 1
+    assert (await database.transactions.find_one({"id": txn_id}))["status"] == "cancelled"
+    assert (await database.cards.find_one({"id": trader["card"]["id"]}))["current_usage"] == 0
+    assert await database.outbox.count_documents({"type": "transaction.expired"}) == 1
+
+
+async def test_user_transactions_include_archive(client, database, trader, user_headers):
+    txn_id = (await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10})).json()["transaction_id"]
+    await database.transactions.update_one({"id": txn_id}, {"$set": {
+        "status": "completed",
+        "created_at": datetime.now(timezone.utc) - timedelta(days=server.ARCHIVE_AFTER_DAYS + 1)
+    }})
+    assert await server.archive_settled_transactions() == 1
+
+    hot = (await client.get("/api/user/transactions", headers=user_headers)).json()
+    both = (await client.get("/api/user/transactions?include_archived=true", headers=user_headers)).json()
+    assert hot == []
+    assert [txn["id"] for txn in both] == [txn_id]
+    stats = (await client.get("/api/stats", headers=user_headers)).json()
+    assert stats["completed_transactions"] == 1
+
+
+async def test_failed_outbox_write_undoes_the_allocation(client, database, trader, user_headers, monkeypatch):
+    fail_outbox_writes(database, monkeypatch)
+    with pytest.raises(ConnectionError):
+        await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10})
+
+    assert await database.transactions.count_documents({}) == 0
+    assert (await database.cards.find_one({"id": trader["card"]["id"]}))["current_usage"] == 0
+
+
+async def test_failed_confirmation_can_be_retried(client, database, trader, user_headers, monkeypatch):
+    txn_id = (await client.post("/api/user/request-card", headers=user_headers, json={"amount": 10})).json()["transaction_id"]
+    insert_many = type(database.outbox).insert_many
+    fail_outbox_writes(database, monkeypatch)
+    with pytest.raises(ConnectionError):
+        await client.post(f"/api/user/confirm-payment/{txn_id}", headers=user_headers)
+    assert (await database.transactions.find_one({"id": txn_id}))["status"] == "pending"
+
+    monkeypatch.setattr(type(database.outbox), "insert_many", insert_many)
+    assert (await client.post(f"/api/user/confirm-payment/{txn_id}", headers=user_headers)).status_code == 200
+    assert await database.outbox.count_documents({"type": "transaction.user_confirmed"}) == 1
+
+
+async def test_expiry_releases_usage_when_the_outbox_write_fails(client, database, trader, user_headers, monkeypatch):
+    for amount in (10, 20):
+        await client.post("/api/user/request-card", headers=user_headers, json={"amount": amount})
+    await database.transactions.update_many({}, {"$set": {"expires_at": datetime.now(timezone.utc) - timedelta(minutes=1)}})
+    fail_outbox_writes(database, monkeypatch)
+
+    assert await server.expire_pending_transactions() == 2
+    assert await database.transactions.count_documents({"status": "cancelled"}) == 2
+    assert (await database.cards.find_one({"id": trader["card"]["id"]}))["current_usage"] == pytest.approx(0)
+
+
+async def test_archived_counts_expire_and_stay_bounded(database, monkeypatch):
+    monkeypatch.setattr(server, "ARCHIVE_COUNT_CACHE_SIZE", 2)
+    await database.transactions_archive.insert_one({"id": "old", "user_id": "u1", "created_at": datetime.now(timezone.utc)})
+    for user_id in ("u1", "u2", "u3"):
+        await server.count_archived({"user_id": user_id})
+    assert len(server._archived_counts) == 2
+
+    # Another worker archived more; the cached count is only served until it expires
+    await database.transactions_archive.insert_one({"id": "older", "user_id": "u3", "created_at": datetime.now(timezone.utc)})
+    assert await server.count_archived({"user_id": "u3"}) == 0
+    for key, (_, count) in list(server._archived_counts.items()):
+        server._archived_counts[key] = (0.0, count)
+    assert await server.count_archived({"user_id": "u3"}) == 1